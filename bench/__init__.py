@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+""" 简单的benchmark框架
+
+    python -m bench                 # 运行所有benchmark，和基线比较
+    python -m bench -k reqparse     # 只运行名字包含reqparse的
+    python -m bench --save          # 把结果保存为新的基线
+
+基线保存在`bench/baseline.json`，和机器有关，换机器后需要重新保存
+"""
+from __future__ import absolute_import, print_function
+import json
+import time
+import timeit
+import platform
+from collections import OrderedDict
+
+__all__ = ["benchmark", "run", "load_baseline", "save_baseline", "compare"]
+
+_benchmarks = OrderedDict()
+
+
+def benchmark(name, ops=1):
+    """ 注册benchmark，被装饰的函数做准备工作并返回需要计时的函数
+        ops: 计时函数每次调用包含的操作次数，结果按单次操作计算
+    """
+    def deco(setup):
+        _benchmarks[name] = (setup, ops)
+        return setup
+    return deco
+
+
+def _measure(func, repeat, mintime):
+    """ 自动调整次数，返回单次调用耗时的中位数(秒)
+    中位数比最小值稳定，同一台机器上重复运行的波动更小
+    """
+    timer = timeit.Timer(func)
+    number = 1
+    while True:
+        elapsed = timer.timeit(number)
+        if elapsed >= mintime or number >= 10 ** 7:
+            break
+        number *= 10 if elapsed < mintime / 10 else 2
+    times = sorted([elapsed] + timer.repeat(repeat - 1, number))
+    return times[len(times) // 2] / number
+
+
+def run(pattern=None, repeat=5, mintime=0.1):
+    """ 运行benchmark，返回`{名字: 每次操作的微秒数}` """
+    results = OrderedDict()
+    for name, (setup, ops) in _benchmarks.items():
+        if pattern and pattern not in name:
+            continue
+        func = setup()
+        results[name] = _measure(func, repeat, mintime) / ops * 1e6
+    return results
+
+
+def load_baseline(filename):
+    try:
+        with open(filename) as f:
+            return json.load(f)["results"]
+    except IOError:
+        return {}
+
+
+def save_baseline(filename, results):
+    data = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        },
+        "results": results,
+    }
+    with open(filename, "w") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+
+
+def compare(results, baseline, threshold=0.25):
+    """ 输出和基线的对比，返回变慢超过`threshold`的benchmark名字 """
+    regressions = []
+    print("%-36s %12s %12s %9s" % ("benchmark", "us/op", "baseline",
+                                    "change"))
+    for name, value in results.items():
+        base = baseline.get(name)
+        if base:
+            change = (value - base) / base
+            mark = ""
+            if change > threshold:
+                mark = "  SLOWER"
+                regressions.append(name)
+            elif change < -threshold:
+                mark = "  faster"
+            print("%-36s %12.3f %12.3f %+8.1f%%%s" % (
+                name, value, base, change * 100, mark))
+        else:
+            print("%-36s %12.3f %12s %9s" % (name, value, "-", "-"))
+    return regressions
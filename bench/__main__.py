@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function
+import os
+import sys
+import argparse
+from bench import run, load_baseline, save_baseline, compare
+import bench.suite  # noqa 注册benchmark
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        "baseline.json")
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m bench")
+    parser.add_argument("-k", dest="pattern", help="only run matched names")
+    parser.add_argument("--save", action="store_true",
+                        help="save results as the new baseline")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="regression threshold, 0.25 means 25%%")
+    options = parser.parse_args()
+
+    results = run(options.pattern, options.repeat)
+    baseline = load_baseline(options.baseline)
+    regressions = compare(results, baseline, options.threshold)
+    if options.save:
+        baseline.update(results)
+        save_baseline(options.baseline, baseline)
+        print("baseline saved to %s" % options.baseline)
+    elif regressions:
+        print("%d regression(s): %s" % (len(regressions),
+                                         ", ".join(regressions)))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
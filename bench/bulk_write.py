@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+""" 对比逐个对象写入和批量写入的耗时
+
+    python -m bench.bulk_write [行数]
+"""
+from __future__ import print_function
+import sys
+import time
+from moon.sqlalchemy import SQLAlchemy
+
+
+db = SQLAlchemy()
+
+
+class Item(db.Model):
+    __tablename__ = "bench_item"
+    _csupdate_keys = ("name", "score")
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(32))
+    score = db.Column(db.Integer)
+    update_time = db.Column(db.DateTime)
+
+
+def timeit(title, func):
+    start = time.time()
+    func()
+    db.session.commit()
+    print("%-24s %.3fs" % (title, time.time() - start))
+
+
+def main(count=20000):
+    db.use_scoped_session(sa_url="sqlite://")
+    db.create_all()
+    rows = [{"id": i, "name": "item-%d" % i, "score": i} for i in range(count)]
+
+    def orm_insert():
+        for row in rows:
+            db.session.add(Item(**row))
+
+    def orm_update():
+        for item in Item.query:
+            item.cs_update(score=item.score + 1)
+
+    def orm_delete():
+        Item.query.delete()
+
+    print("%d rows" % count)
+    timeit("orm insert", orm_insert)
+    timeit("orm cs_update", orm_update)
+    timeit("delete", orm_delete)
+    timeit("bulk_insert", lambda: db.bulk_insert(Item, rows))
+    timeit("bulk_update", lambda: db.bulk_update(
+        Item, [dict(row, score=row["score"] + 1) for row in rows]))
+    timeit("bulk_upsert", lambda: db.bulk_upsert(Item, rows))
+
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:]])
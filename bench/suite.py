@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+""" moon中常用代码的benchmark """
+from __future__ import absolute_import
+import json
+import logging
+from datetime import datetime
+from bench import benchmark
+
+
+# moon.web.reqparse
+###############################################################################
+class _Request(object):
+    def __init__(self, values, json=None):
+        # 和`_parser`一样在运行时导入，没有安装werkzeug也能运行其它benchmark
+        from werkzeug.datastructures import MultiDict
+        self.values = MultiDict(values)
+        self.json = json
+
+
+def _parser():
+    from moon.web.reqparse import RequestParser
+    parser = RequestParser()
+    parser.add_argument("id", type=int, required=True)
+    parser.add_argument("status", choices=(u"open", u"closed", u"draft"),
+                        case_sensitive=False)
+    parser.add_taglist_argument("tags", 20, 10)
+    parser.add_timestamp_argument("since", mintime=datetime(2000, 1, 1))
+    parser.add_timestamp_argument("until")
+    parser.add_bool_argument("archived")
+    parser.add_phone_argument("phone")
+    parser.add_email_argument("email")
+    parser.add_int_argument("page", min=1, max=1000)
+    parser.add_int_argument("per_page", min=1, max=100)
+    parser.add_position_argument("pos", need_desc=False)
+    parser.add_argument("q", max_len=200)
+    parser.add_argument("sort", default=u"id")
+    parser.add_argument("price", type=float, operators=("=", ">=", "<="),
+                        action="append")
+    for i in range(10):
+        parser.add_argument("opt%d" % i)
+    return parser
+
+
+@benchmark("reqparse.parse_args")
+def bench_parse_args():
+    parser = _parser()
+    req = _Request([
+        ("id", u"42"), ("status", u"Open"), ("tags[]", u"python"),
+        ("tags[]", u"web"), ("since", u"1500000000"), ("archived", u"false"),
+        ("phone", u"13800000000"), ("email", u"someone@example.com"),
+        ("page", u"3"), ("per_page", u"20"), ("pos", u"116.3:39.9"),
+        ("q", u"keyword"), ("price>", u"10.5"), ("price<", u"99"),
+        ("opt1", u"a"), ("opt7", u"b"),
+    ])
+    return lambda: parser.parse_args(req)
+
+
+# moon.lazy
+###############################################################################
+class _Target(object):
+    value = 1
+
+    def __add__(self, other):
+        return self.value + other
+
+    def __getitem__(self, key):
+        return key
+
+
+@benchmark("lazy.LazyProxy.getattr")
+def bench_proxy_getattr():
+    from moon.lazy import LazyProxy
+    target = _Target()
+    proxy = LazyProxy(lambda: target)
+    return lambda: proxy.value
+
+
+@benchmark("lazy.LazyProxy.operators", ops=2)
+def bench_proxy_operators():
+    from moon.lazy import LazyProxy
+    target = _Target()
+    proxy = LazyProxy(lambda: target)
+
+    def func():
+        proxy + 1
+        proxy["key"]
+    return func
+
+
+# moon.utils
+###############################################################################
+@benchmark("utils.cached_property")
+def bench_cached_property():
+    from moon.utils import cached_property
+
+    class Foo(object):
+        @cached_property
+        def foo(self):
+            return 42
+
+    obj = Foo()
+    obj.foo
+    return lambda: obj.foo
+
+
+# moon.funclimit
+###############################################################################
+@benchmark("funclimit.LimitTimes.require_call", ops=1000)
+def bench_require_call():
+    from moon.funclimit import LimitTimes
+
+    def func():
+        limit = LimitTimes(100000, 60)
+        for _ in range(1000):
+            limit.require_call()
+    return func
+
+
+# moon.logging
+###############################################################################
+def _funclogger(level):
+    from moon.logging import FuncLogger
+    logger = logging.getLogger("bench.funclogger")
+    logger.propagate = False
+    logger.handlers = [logging.NullHandler()]
+    logger.setLevel(level)
+    return FuncLogger(logger)
+
+
+@benchmark("logging.FuncLogger.disabled")
+def bench_funclogger_disabled():
+    funclogger = _funclogger(logging.INFO)
+
+    @funclogger(printkey="a")
+    def func(a, b=2):
+        return a
+    return lambda: func(1)
+
+
+@benchmark("logging.FuncLogger.enabled")
+def bench_funclogger_enabled():
+    funclogger = _funclogger(logging.DEBUG)
+
+    @funclogger(printkey="a")
+    def func(a, b=2):
+        return a
+    return lambda: func(1)
+
+
+# moon.string
+###############################################################################
+@benchmark("string.truncate_unicode", ops=1000)
+def bench_truncate_unicode():
+    from moon.string import truncate_unicode
+    corpus = [(u"中文和English混合的一段文字，" * (i % 10 + 1)) for i in range(1000)]
+
+    def func():
+        for s in corpus:
+            truncate_unicode(s, 40)
+    return func
+
+
+@benchmark("string.validate_isbn", ops=1000)
+def bench_validate_isbn():
+    from moon.string import validate_isbn, ISBNError
+    corpus = ["9787111213826", "7111213820", "978-7-111-21382-6",
+              "9787111213827"] * 250
+
+    def func():
+        for isbn in corpus:
+            try:
+                validate_isbn(isbn, allow_dash=True)
+            except ISBNError:
+                pass
+    return func
+
+
+# moon.NameSpace
+###############################################################################
+@benchmark("NameSpace.fromdict")
+def bench_namespace_fromdict():
+    from moon import NameSpace
+
+    def tree(depth):
+        if depth == 0:
+            return {"id": 1, "name": "leaf", "tags": ["a", "b"]}
+        return {"level": depth, "children": [tree(depth - 1)] * 3,
+                "meta": {"x": 1, "y": [1, 2, 3]}}
+    data = json.loads(json.dumps(tree(5)))
+    return lambda: NameSpace.fromdict(data)
+
+
+# moon.sqlalchemy
+###############################################################################
+def _database():
+    from moon.sqlalchemy import SQLAlchemy
+    db = SQLAlchemy()
+
+    class Item(db.Model):
+        __tablename__ = "bench_item"
+        id = db.Column(db.Integer, primary_key=True)
+        name = db.Column(db.String(32))
+        score = db.Column(db.Integer)
+        ctime = db.Column(db.DateTime)
+
+    db.use_scoped_session(sa_url="sqlite://")
+    db.create_all()
+    now = datetime.utcnow()
+    db.bulk_insert(Item, [{"id": i, "name": "item-%d" % i, "score": i % 97,
+                           "ctime": now} for i in range(10000)])
+    db.session.commit()
+    return db, Item
+
+
+@benchmark("sqlalchemy.paginate")
+def bench_paginate():
+    db, Item = _database()
+    query = Item.query.filter(Item.score > 10).order_by(Item.id)
+
+    def func():
+        query.paginate(50, 20)
+        db.session.remove()
+    return func
+
+
+@benchmark("sqlalchemy.Model.to_dict", ops=100)
+def bench_to_dict():
+    db, Item = _database()
+    items = Item.query.limit(100).all()
+    return lambda: [item.to_dict() for item in items]
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+""" 装饰器的asyncio版本，需要python3.5+，装饰`async def`函数时自动使用 """
+import asyncio
+from functools import wraps
+
+from .utils import _missing
+
+
+__all__ = ["limit_coroutine", "memoize_coroutine"]
+
+
+def limit_coroutine(limit, func, getkey):
+    """ :class:`moon.funclimit.LimitTimes`装饰`async def`函数，
+    等待时使用`asyncio.sleep`，`fair`时同一个key按照先来后到的顺序调用
+    """
+    # key => [asyncio.Lock, 使用中的数量]
+    locks = {}
+
+    async def wait_call(key, deadline):
+        loop = asyncio.get_event_loop()
+        while True:
+            delay = limit.next_delay(key, None)
+            if delay is None:
+                return True
+            if deadline is not None:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return False
+                delay = min(delay, remaining)
+            await asyncio.sleep(delay)
+
+    async def fair_wait_call(key, deadline):
+        # asyncio.Lock的等待者是先进先出的
+        entry = locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        lock = entry[0]
+        try:
+            if deadline is None:
+                await lock.acquire()
+            else:
+                remaining = deadline - asyncio.get_event_loop().time()
+                await asyncio.wait_for(lock.acquire(), max(remaining, 0))
+        except asyncio.TimeoutError:
+            return False
+        else:
+            try:
+                return await wait_call(key, deadline)
+            finally:
+                lock.release()
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del locks[key]
+
+    @wraps(func)
+    async def decoed(*args, **kwargs):
+        key = getkey(*args, **kwargs) if getkey else None
+        if limit.block:
+            deadline = None
+            if limit.max_wait is not None:
+                deadline = asyncio.get_event_loop().time() + limit.max_wait
+            if limit.fair:
+                allowed = await fair_wait_call(key, deadline)
+            else:
+                allowed = await wait_call(key, deadline)
+        else:
+            allowed = limit.require_call(key)
+        if allowed:
+            return await func(*args, **kwargs)
+        return limit._reject()
+    return decoed
+
+
+def memoize_coroutine(cache, func, makekey):
+    """ :func:`moon.utils.memoize`装饰`async def`函数，
+    同一个key同时只await一次，其它调用等待同一个结果
+    """
+    # key => asyncio.Future
+    pending = {}
+
+    @wraps(func)
+    async def decoed(*args, **kwargs):
+        key = makekey(args, kwargs)
+        while True:
+            future = pending.get(key)
+            if future is None:
+                value = cache.get(key)
+                if value is not _missing:
+                    return value
+                break
+            value = await asyncio.shield(future)
+            # 计算出错或者被取消时重新尝试
+            if value is not _missing:
+                cache.shared()
+                return value
+
+        future = pending[key] = asyncio.get_event_loop().create_future()
+        value = _missing
+        try:
+            value = await func(*args, **kwargs)
+            cache.set(key, value)
+            return value
+        finally:
+            del pending[key]
+            future.set_result(value)
+    return decoed
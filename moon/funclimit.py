@@ -1,61 +1,418 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import
+import os
 import time
+import inspect
+import sqlite3
+import threading
+from collections import deque, OrderedDict
 from functools import wraps
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+__all__ = ["LimitTimes", "SlidingLog", "SlidingWindow", "TokenBucket",
+           "LocalBackend", "SQLiteBackend"]
+
+# python2中没有monotonic
+clock = getattr(time, "monotonic", time.time)
+_getargspec = getattr(inspect, "getfullargspec", None) or inspect.getargspec
+
+
+class SlidingLog(object):
+    """ 记录时间段内每次调用的时间，精确，内存和限制次数成正比 """
+    def __init__(self, times, spanseconds):
+        self.times = times
+        self.spanseconds = spanseconds
+        self.history = deque()
+
+    def acquire(self, now):
+        history = self.history
+        if self.spanseconds is not None:
+            edge = now - self.spanseconds
+            while history and history[0] <= edge:
+                history.popleft()
+
+        if len(history) < self.times:
+            history.append(now)
+            return True
+        return False
+
+    def delay(self, now):
+        """ `acquire`失败后，预计多少秒之后可以调用，None表示不会再有机会 """
+        if self.spanseconds is None or not self.history:
+            return None
+        return self.history[0] + self.spanseconds - now
+
+
+class SlidingWindow(object):
+    """ 只记录当前和上一个时间段的次数，按时间比例估算滑动窗口内的次数，
+    内存固定，结果是近似的
+    """
+    def __init__(self, times, spanseconds):
+        self.times = times
+        self.spanseconds = spanseconds
+        self.start = None
+        self.current = 0
+        self.previous = 0
+
+    def acquire(self, now):
+        span = self.spanseconds
+        if span is None:
+            if self.current < self.times:
+                self.current += 1
+                return True
+            return False
+
+        if self.start is None:
+            self.start = now
+        elapsed = now - self.start
+        if elapsed >= span:
+            windows = int(elapsed // span)
+            self.previous = self.current if windows == 1 else 0
+            self.current = 0
+            self.start += windows * span
+            elapsed -= windows * span
+
+        estimated = self.previous * (span - elapsed) / span + self.current
+        if estimated < self.times:
+            self.current += 1
+            return True
+        return False
+
+    def delay(self, now):
+        span = self.spanseconds
+        if span is None or not self.times:
+            return None
+        if self.current >= self.times:
+            # 等到下一个时间段，并且上一段的估算值降到限制以下
+            rest = 1 - float(self.times) / self.current
+            return self.start + span - now + span * rest
+        rest = 1 - float(self.times - self.current) / self.previous
+        return self.start + span * rest - now
+
+
+class TokenBucket(object):
+    """ 令牌桶，容量为`times`，每`spanseconds`秒补充`times`个令牌，
+    允许突发`times`次调用
+    """
+    def __init__(self, times, spanseconds):
+        self.times = times
+        self.spanseconds = spanseconds
+        self.tokens = float(times)
+        self.last = None
+
+    def acquire(self, now):
+        if self.spanseconds is not None and self.last is not None:
+            rate = float(self.times) / self.spanseconds
+            self.tokens = min(self.times,
+                              self.tokens + (now - self.last) * rate)
+        self.last = now
+
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def delay(self, now):
+        if self.spanseconds is None or not self.times:
+            return None
+        rate = float(self.times) / self.spanseconds
+        return (1 - self.tokens) / rate
+
+
+def _try(limiter, now):
+    """ 返回(是否可以调用, 不能调用时预计等待的秒数) """
+    if limiter.acquire(now):
+        return True, 0
+    delay = getattr(limiter, "delay", None)
+    return False, delay(now) if delay is not None else None
+
+
+class LocalBackend(object):
+    """ 在进程内保存限制的状态，用锁保证多线程下计数正确
+        max_keys: 按key限制时最多保存多少个key，超出后淘汰最久没有调用的
+    """
+    def __init__(self, max_keys=10000):
+        self.max_keys = max_keys
+        self._limiters = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        return self._limiters.get(key)
+
+    def acquire(self, key, factory):
+        with self._lock:
+            limiter = self._limiters.pop(key, None)
+            if limiter is None:
+                limiter = factory()
+            self._limiters[key] = limiter
+            if len(self._limiters) > self.max_keys:
+                self._limiters.popitem(last=False)
+            return _try(limiter, clock())
+
+
+class SQLiteBackend(object):
+    """ 在本地SQLite文件中保存限制的状态，同一台机器上的多个进程共享限制
+    每次调用都在一个写事务中完成，建议配合"window"或"bucket"使用
+        path: SQLite文件路径
+        name: 同一个文件中区分不同的限制
+        timeout: 等待文件锁的秒数
+    """
+    def __init__(self, path, name="default", timeout=10):
+        self.path = path
+        self.name = name
+        self.timeout = timeout
+        self._local = threading.local()
+        self._connect().execute(
+            "CREATE TABLE IF NOT EXISTS funclimit ("
+            "name TEXT, key TEXT, state BLOB, PRIMARY KEY (name, key))")
+
+    def _connect(self):
+        # 连接不能跨线程使用，也不能在fork之后继续使用
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.timeout,
+                                   isolation_level=None)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def acquire(self, key, factory):
+        conn = self._connect()
+        key = repr(key)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT state FROM funclimit WHERE name = ? AND key = ?",
+                (self.name, key)).fetchone()
+            limiter = pickle.loads(bytes(row[0])) if row else factory()
+            # 多个进程之间只能使用墙上时间
+            result = _try(limiter, time.time())
+            state = pickle.dumps(limiter, pickle.HIGHEST_PROTOCOL)
+            conn.execute(
+                "INSERT OR REPLACE INTO funclimit (name, key, state) "
+                "VALUES (?, ?, ?)", (self.name, key, sqlite3.Binary(state)))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return result
+
+
+def _iscoroutinefunction(func):
+    check = getattr(inspect, "iscoroutinefunction", None)
+    return check is not None and check(func)
+
+
+def _key_getter(func, key):
+    """ 从函数调用的参数中取出限制的key
+        key: 参数名或者和函数参数相同的callable
+    """
+    if key is None or callable(key):
+        return key
+    try:
+        pos = _getargspec(func).args.index(key)
+    except (TypeError, ValueError):
+        pos = None
+
+    def getter(*args, **kwargs):
+        if key in kwargs:
+            return kwargs[key]
+        if pos is not None and pos < len(args):
+            return args[pos]
+        return inspect.getcallargs(func, *args, **kwargs)[key]
+    return getter
 
 
 class LimitTimes(object):
     """ 限制函数在指定时间内执行次数
         times: 限制的次数
-        spanseconds: 在多长的时间段内限制
+        spanseconds: 在多长的时间段内限制，可以是小数，None表示不限时间段
         silence: 超出限制后是否静默返回None或者抛出异常
+        strategy: 限制的算法，"log"(默认，精确), "window"(固定内存，近似),
+                  "bucket"(令牌桶)，或者自定义的类
+        key: 按参数分别限制，参数名(例如"user_id")或者接受相同参数的函数
+        backend: 保存状态的位置，默认为:class:`LocalBackend`，
+                 多进程共享时使用:class:`SQLiteBackend`
+        block: 超出限制时等待，直到可以调用或者超过`max_wait`秒(None表示一直等)，
+               超时后按照`silence`处理
+        fair: 等待时按照先来后到的顺序调用
+        poll_interval: 无法预计等待时间时，重试的间隔秒数
+    可以装饰`async def`函数(需要python3)，等待时不会阻塞event loop
     """
-    def __init__(self, times, spanseconds, silence=False):
+    strategies = {
+        "log": SlidingLog,
+        "window": SlidingWindow,
+        "bucket": TokenBucket,
+    }
+
+    def __init__(self, times, spanseconds, silence=False, strategy="log",
+                 key=None, backend=None, block=False, max_wait=None,
+                 fair=False, poll_interval=0.05):
         self.times = times
         self.spanseconds = spanseconds
         self.silence = silence
-        self.history = []
+        if not isinstance(strategy, type):
+            strategy = self.strategies[strategy]
+        self.strategy = strategy
+        self.key = key
+        self.backend = backend if backend is not None else LocalBackend()
+        self.block = block
+        self.max_wait = max_wait
+        self.fair = fair
+        self.poll_interval = poll_interval
+        self._cond = threading.Condition()
+        self._queues = {}
 
-    def require_call(self):
-        curts = int(time.time())
+    def _new_limiter(self):
+        return self.strategy(self.times, self.spanseconds)
 
-        if self.spanseconds is not None:
-            prets = curts - self.spanseconds
-            fn = lambda h: h > prets
-            self.history = filter(fn, self.history)
+    @property
+    def history(self):
+        limiter = getattr(self.backend, "get", lambda key: None)(None)
+        return getattr(limiter, "history", None)
 
-        if len(self.history) < self.times:
-            self.history.append(curts)
-            return True
-        else:
-            return False
+    def require_call(self, key=None):
+        return self.backend.acquire(key, self._new_limiter)[0]
+
+    def next_delay(self, key, deadline):
+        """ 尝试调用，可以调用时返回None，否则返回下次尝试前等待的秒数，
+        超过deadline时返回False
+        """
+        ok, delay = self.backend.acquire(key, self._new_limiter)
+        if ok:
+            return None
+        if delay is None:
+            delay = self.poll_interval
+        delay = max(delay, 0.001)
+        if deadline is not None:
+            remaining = deadline - clock()
+            if remaining <= 0:
+                return False
+            delay = min(delay, remaining)
+        return delay
+
+    def wait_call(self, key=None, max_wait=None):
+        """ 等待直到可以调用，超过max_wait秒返回False """
+        deadline = clock() + max_wait if max_wait is not None else None
+        if not self.fair:
+            return self._wait(key, deadline)
+
+        ticket = object()
+        with self._cond:
+            queue = self._queues.setdefault(key, deque())
+            queue.append(ticket)
+        try:
+            with self._cond:
+                while queue[0] is not ticket:
+                    remaining = None
+                    if deadline is not None:
+                        remaining = deadline - clock()
+                        if remaining <= 0:
+                            return False
+                    self._cond.wait(remaining)
+            return self._wait(key, deadline)
+        finally:
+            with self._cond:
+                queue.remove(ticket)
+                if not queue and self._queues.get(key) is queue:
+                    del self._queues[key]
+                self._cond.notify_all()
+
+    def _wait(self, key, deadline):
+        while True:
+            delay = self.next_delay(key, deadline)
+            if delay is None:
+                return True
+            if delay is False:
+                return False
+            time.sleep(delay)
+
+    def _allowed(self, key):
+        if self.block:
+            return self.wait_call(key, self.max_wait)
+        return self.require_call(key)
+
+    def _reject(self):
+        if self.silence:
+            return None
+        raise RuntimeError("Out of call limits")
 
     def __call__(self, func):
+        getkey = _key_getter(func, self.key)
+        if _iscoroutinefunction(func):
+            from .aio import limit_coroutine
+            return limit_coroutine(self, func, getkey)
+
         @wraps(func)
         def decoed(*args, **kwargs):
-            if self.require_call():
+            key = getkey(*args, **kwargs) if getkey else None
+            if self._allowed(key):
                 return func(*args, **kwargs)
-            else:
-                if self.silence:
-                    return None
-                else:
-                    raise RuntimeError("Out of call limits")
+            return self._reject()
         return decoed
 
 
 if __name__ == "__main__":
 
-    @LimitTimes(3, 1, silence=True)
-    def testfunc():
+    for strategy in ("log", "window", "bucket"):
+        @LimitTimes(3, 1, silence=True, strategy=strategy)
+        def testfunc():
+            return "OK"
+
+        assert testfunc() == "OK"
+        assert testfunc() == "OK"
+        assert testfunc() == "OK"
+        assert testfunc() is None
+
+        time.sleep(2.1)
+
+        assert testfunc() == "OK"
+
+    @LimitTimes(2, None, silence=True, strategy="window")
+    def forever():
         return "OK"
 
-    assert testfunc() == "OK"
-    assert testfunc() == "OK"
-    assert testfunc() == "OK"
-    assert testfunc() is None
+    assert forever() == "OK"
+    assert forever() == "OK"
+    assert forever() is None
+
+    @LimitTimes(1, 10, silence=True, key="user")
+    def peruser(user, data=None):
+        return user
+
+    assert peruser(1) == 1
+    assert peruser(2) == 2
+    assert peruser(user=1) is None
+
+    import tempfile
+    path = os.path.join(tempfile.mkdtemp(), "funclimit.db")
+    for _ in range(2):
+        backend = SQLiteBackend(path, "test")
+
+        @LimitTimes(3, 10, silence=True, strategy="window", backend=backend)
+        def shared():
+            return "OK"
+
+        results = [shared() for _ in range(2)]
+    assert results == ["OK", None]
+    os.remove(path)
+
+    @LimitTimes(2, 0.2, block=True, strategy="window")
+    def blocking():
+        return clock()
+
+    start = clock()
+    results = [blocking() - start for _ in range(5)]
+    assert results[1] < 0.1 and results[2] > 0.1 and results[4] > 0.3
+
+    @LimitTimes(1, 10, silence=True, block=True, max_wait=0.1)
+    def timeout():
+        return "OK"
 
-    time.sleep(2)
-    
-    assert testfunc() == "OK"
+    assert timeout() == "OK"
+    assert timeout() is None
 
-    print "passed"
+    print("passed")
@@ -2,90 +2,518 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import
 import os
+import re
+import sys
+import json
+import time
+import random
 import logging
+import itertools
+import socket
+import threading
 from logging import Formatter
 from logging.handlers import SysLogHandler as _SysLogHandler
+from logging.handlers import RotatingFileHandler
 import inspect
 from pprint import pformat
 from functools import wraps
+try:
+    import Queue as queue
+except ImportError:
+    import queue
 
-__all__ = ["setlogging", "FuncLogger", "SysLogHandler"]
+__all__ = ["setlogging", "FuncLogger", "SysLogHandler", "JSONFormatter",
+           "caller", "caller_name", "frame_name"]
 
+_getargspec = getattr(inspect, "getfullargspec", None) or inspect.getargspec
+_wallclock = getattr(time, "perf_counter", time.time)
+# python2中只有进程级别的CPU时间
+_cpuclock = (getattr(time, "thread_time", None) or
+             getattr(time, "process_time", None) or time.clock)
 
-def setlogging(logfile="debug.log"):
-    """ 设置简单日志 """
-    fmt = "[%(asctime)s] {%(pathname)s:%(lineno)d} %(levelname)s - %(message)s"
+
+def setlogging(logfile="debug.log", json_format=False, max_bytes=0,
+               backup_count=5):
+    """ 设置简单日志
+        json_format: 每条日志输出为一行JSON
+        max_bytes: 日志文件超过这个大小时轮转，0表示不轮转
+        backup_count: 轮转时保留的文件个数
+    """
+    root = logging.getLogger()
+    # 和`logging.basicConfig`一样，已经设置过时不做任何事情
+    if root.handlers:
+        return
     if logfile:
         filename = os.path.abspath(os.path.join(os.getcwd(), "log", logfile))
-        logging.basicConfig(filename=filename, format=fmt, level=logging.DEBUG)
+        if max_bytes:
+            handler = RotatingFileHandler(filename, maxBytes=max_bytes,
+                                          backupCount=backup_count)
+        else:
+            handler = logging.FileHandler(filename)
+    else:
+        handler = logging.StreamHandler()
+    if json_format:
+        handler.setFormatter(JSONFormatter())
     else:
-        logging.basicConfig(format=fmt, level=logging.DEBUG)
+        fmt = ("[%(asctime)s] {%(pathname)s:%(lineno)d} "
+               "%(levelname)s - %(message)s")
+        handler.setFormatter(Formatter(fmt))
+    root.addHandler(handler)
+    root.setLevel(logging.DEBUG)
+
+
+# LogRecord自带的属性，其它属性都是通过`extra`传入的
+_RECORD_ATTRS = frozenset(logging.makeLogRecord({}).__dict__) | frozenset(
+    ["message", "asctime"])
+# JSONFormatter自己输出的字段，static和extra中的同名字段会被忽略
+_JSON_FIELDS = frozenset(["time", "level", "file", "line", "message",
+                          "logger", "exc_info"])
+
+
+class JSONFormatter(Formatter):
+    """ 每条日志格式化为一行JSON，`extra`传入的字段也会输出
+        static: 每条日志都附带的固定字段
+    每个logger的固定字段只编码一次，时间字符串每秒只格式化一次
+    字段名重复时依次保留内置字段、static、extra中的值
+    """
+    def __init__(self, static=None, datefmt="%Y-%m-%dT%H:%M:%S"):
+        super(JSONFormatter, self).__init__(datefmt=datefmt)
+        self.static = dict((k, v) for k, v in (static or {}).items()
+                           if k not in _JSON_FIELDS)
+        self._skip = _RECORD_ATTRS | _JSON_FIELDS | frozenset(self.static)
+        self._encode = json.JSONEncoder(separators=(",", ":"),
+                                        default=repr).encode
+        self._prefixes = {}
+        self._second = None
+        self._timestr = None
+
+    def _prefix(self, name):
+        prefix = self._prefixes.get(name)
+        if prefix is None:
+            fields = dict(self.static, logger=name)
+            prefix = self._encode(fields)[:-1]
+            self._prefixes[name] = prefix
+        return prefix
+
+    def _time(self, created):
+        second = int(created)
+        if second != self._second:
+            self._timestr = time.strftime(self.datefmt,
+                                          time.localtime(second))
+            self._second = second
+        return "%s.%03d" % (self._timestr, (created - second) * 1000)
+
+    def format(self, record):
+        fields = {
+            "time": self._time(record.created),
+            "level": record.levelname,
+            "file": record.pathname,
+            "line": record.lineno,
+            "message": record.getMessage(),
+        }
+        skip = self._skip
+        for key, value in record.__dict__.items():
+            if key not in skip:
+                fields[key] = value
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            fields["exc_info"] = record.exc_text
+        return self._prefix(record.name) + "," + self._encode(fields)[1:]
 
 
 class SysLogHandler(_SysLogHandler):
-    """ 扩展标准库的SysLogHandler，使用loggername作为tag """
+    """ 扩展标准库的SysLogHandler，使用loggername作为tag
+        queue_size: 不为None时使用非阻塞模式，日志先放入这个大小的队列，
+                    由后台线程格式化并发送
+        overflow: 队列满时的处理方式，"drop_oldest"(丢弃最早的),
+                  "drop_new"(丢弃新的)或者"block"(等待)
+        batch_size: 后台线程每次最多发送多少条，TCP时合并为一次写入
+    非阻塞模式下`sent`和`dropped`记录已发送和被丢弃的条数
+    """
+    overflows = ("drop_oldest", "drop_new", "block")
 
-    def __init__(self, tag=None, withpid=False, **kwargs):
+    def __init__(self, tag=None, withpid=False, queue_size=None,
+                 overflow="drop_oldest", batch_size=64, **kwargs):
         super(SysLogHandler, self).__init__(**kwargs)
         # 产生tag的formatter
         fmt = tag or "%(name)s"
         if withpid:
             fmt += "[%(process)d]"
         self.tag_formatter = Formatter(fmt)
+        # tag只用到name和process时，每个logger只格式化一次
+        self._tags = None
+        if set(re.findall(r"%\((\w+)\)", fmt)) <= set(["name", "process"]):
+            self._tags = {}
+
+        if overflow not in self.overflows:
+            raise ValueError("Invalid overflow: %r" % (overflow, ))
+        self.overflow = overflow
+        self.batch_size = batch_size
+        self.sent = 0
+        self.dropped = 0
+        self._queue = None
+        self._thread = None
+        if queue_size is not None:
+            self._queue = queue.Queue(queue_size)
+            self._thread = threading.Thread(target=self._worker,
+                                            name="SysLogHandler")
+            self._thread.daemon = True
+            self._thread.start()
 
     def format(self, record):
         msg = super(SysLogHandler, self).format(record)
-        tag = self.tag_formatter.format(record)
+        if self._tags is None:
+            return "%s: %s" % (self.tag_formatter.format(record), msg)
+        key = (record.name, record.process)
+        tag = self._tags.get(key)
+        if tag is None:
+            tag = self._tags[key] = self.tag_formatter.format(record)
         return "%s: %s" % (tag, msg)
 
+    def emit(self, record):
+        if self._queue is None:
+            return super(SysLogHandler, self).emit(record)
+        # `Handler.handle`已经持有self.lock，这里修改计数不需要再加锁
+        if self.overflow == "block":
+            self._queue.put(record)
+            return
+        while True:
+            try:
+                self._queue.put_nowait(record)
+                return
+            except queue.Full:
+                if self.overflow == "drop_new":
+                    self.dropped += 1
+                    return
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                continue
+            self._queue.task_done()
+            self.dropped += 1
+
+    def flush(self):
+        """ 等待队列中的日志都被发送 """
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.join()
+
+    def close(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+            # 关闭之后的日志同步发送，不再放入没有线程处理的队列
+            self._queue = None
+        super(SysLogHandler, self).close()
+
+    def _worker(self):
+        q = self._queue
+        while True:
+            batch = [q.get()]
+            while batch[-1] is not None and len(batch) < self.batch_size:
+                try:
+                    batch.append(q.get_nowait())
+                except queue.Empty:
+                    break
+            stop = batch[-1] is None
+            records = batch[:-1] if stop else batch
+            try:
+                self._send(records)
+            finally:
+                for _ in batch:
+                    q.task_done()
+            if stop:
+                return
+
+    def _send(self, records):
+        if not records:
+            return
+        if self.unixsocket or self.socktype == socket.SOCK_DGRAM:
+            # 数据报每条日志只能单独发送
+            for record in records:
+                super(SysLogHandler, self).emit(record)
+            self.sent += len(records)
+            return
+        try:
+            data = b"".join(self._encode(record) for record in records)
+            self.socket.sendall(data)
+            self.sent += len(records)
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except Exception:
+            self.handleError(records[0])
+
+    def _encode(self, record):
+        """ 和标准库的`emit`相同的编码方式 """
+        msg = getattr(self, "ident", "") + self.format(record)
+        if getattr(self, "append_nul", True):
+            msg += "\000"
+        prio = "<%d>" % self.encodePriority(
+            self.facility, self.mapPriority(record.levelname))
+        if not isinstance(msg, bytes):
+            msg = msg.encode("utf-8")
+        return prio.encode("utf-8") + msg
+
+
+class _Histogram(object):
+    """ 用蓄水池抽样保存固定数量的样本来估算分位数 """
+    def __init__(self, size):
+        self.size = size
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = []
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+        if len(self.samples) < self.size:
+            self.samples.append(value)
+        else:
+            i = int(random.random() * self.count)
+            if i < self.size:
+                self.samples[i] = value
+
+    def summary(self):
+        samples = sorted(self.samples)
+
+        def percentile(p):
+            if not samples:
+                return 0.0
+            return samples[min(len(samples) - 1, int(p * len(samples)))]
+        return {
+            "count": self.count,
+            "total": self.total,
+            "p50": percentile(0.5),
+            "p95": percentile(0.95),
+            "p99": percentile(0.99),
+            "max": self.max,
+        }
+
+
+class _CallStats(object):
+    """ 单个函数的调用次数和耗时 """
+    def __init__(self, reservoir):
+        self.lock = threading.Lock()
+        self.wall = _Histogram(reservoir)
+        self.cpu = _Histogram(reservoir)
+
+    def record(self, wall, cpu):
+        with self.lock:
+            self.wall.add(wall)
+            self.cpu.add(cpu)
+
+    def summary(self, reset=False):
+        with self.lock:
+            result = {"calls": self.wall.count,
+                      "wall": self.wall.summary(),
+                      "cpu": self.cpu.summary()}
+            if reset:
+                self.wall.reset()
+                self.cpu.reset()
+        return result
+
+
+def _sampler(sample):
+    """ sample为整数N时每N次记录一次，为0到1之间的小数时按概率记录 """
+    if sample is None or sample == 1:
+        return None
+    if isinstance(sample, float) and 0 < sample < 1:
+        return lambda: random.random() < sample
+    if isinstance(sample, int) and sample > 1:
+        counter = itertools.count()
+        return lambda: next(counter) % sample == 0
+    raise ValueError("Invalid sample: %r" % (sample, ))
+
 
 class FuncLogger(object):
-    """ 将函数的被调用记录写入日志 """
-    def __init__(self, logger, level=logging.DEBUG):
+    """ 将函数的被调用记录写入日志
+    日志级别没有开启时，被装饰的函数几乎没有额外开销
+        sample: 只记录部分调用，整数N表示每N次记录一次，小数表示记录的概率
+        timing: 统计每个函数的调用次数，墙上时间和CPU时间的分布
+        reservoir: 每个函数保存多少个耗时样本用来计算分位数
+        flush_interval: 每隔多少秒自动把统计结果写入日志，None表示不自动写入
+    """
+    def __init__(self, logger, level=logging.DEBUG, sample=None,
+                 timing=False, reservoir=1000, flush_interval=None):
         self._logger = logger
         self._level = level
+        self._sample = sample
+        _sampler(sample)
+        self.timing = timing
+        self.reservoir = reservoir
+        self.flush_interval = flush_interval
+        self.stats = {}
+        self._last_flush = _wallclock()
 
     def log(self, msg, *args, **kwargs):
         self._logger.log(self._level, msg, *args, **kwargs)
 
+    def report(self, reset=False):
+        """ 返回每个函数的统计结果 """
+        return dict((name, stats.summary(reset))
+                    for name, stats in self.stats.items())
+
+    def reset(self):
+        self.report(reset=True)
+
+    def flush(self, reset=True):
+        """ 把统计结果写入日志 """
+        self._last_flush = _wallclock()
+        fmt = ("FuncLogger Stats: [%s] calls=%d "
+               "wall(p50=%.6f p95=%.6f p99=%.6f max=%.6f) "
+               "cpu(p50=%.6f p95=%.6f p99=%.6f max=%.6f)")
+        for name, result in sorted(self.report(reset).items()):
+            if not result["calls"]:
+                continue
+            wall, cpu = result["wall"], result["cpu"]
+            self.log(fmt, name, result["calls"],
+                     wall["p50"], wall["p95"], wall["p99"], wall["max"],
+                     cpu["p50"], cpu["p95"], cpu["p99"], cpu["max"])
+
+    def dump(self, fp=None, reset=False):
+        """ 把统计结果输出为JSON，有fp时写入fp """
+        data = json.dumps(self.report(reset), sort_keys=True)
+        if fp is not None:
+            fp.write(data)
+        return data
+
+    def _maybe_flush(self):
+        if _wallclock() - self._last_flush >= self.flush_interval:
+            self.flush()
+
     def __call__(self, printkey=None, repr=pformat, withcaller=False):
+        keys = printkey or ()
+        if not isinstance(keys, (list, tuple)):
+            keys = [keys]
+
         def deco_func(func):
-            @wraps(func)
-            def decoed(*args, **kwargs):
+            # 在装饰时计算好函数名和参数的位置
+            try:
+                spec = _getargspec(func)
+                argnames = spec.args
+                defaults = dict(zip(argnames[-len(spec.defaults):],
+                                    spec.defaults)) if spec.defaults else {}
+            except TypeError:
+                argnames, defaults = [], {}
+            positions = dict((name, i) for i, name in enumerate(argnames))
+            selfpos = positions.get("self")
+            modname = "%s.%s" % (func.__module__, func.__name__)
+            logger, level = self._logger, self._level
+            sampled = _sampler(self._sample)
+            stats = None
+            if self.timing:
+                statname = "%s.%s" % (func.__module__, getattr(
+                    func, "__qualname__", func.__name__))
+                stats = self.stats.setdefault(statname,
+                                              _CallStats(self.reservoir))
+
+            def argument(key, args, kwargs):
+                if key in kwargs:
+                    return kwargs[key]
+                pos = positions.get(key)
+                if pos is not None and pos < len(args):
+                    return args[pos]
+                if key in defaults:
+                    return defaults[key]
+                return inspect.getcallargs(func, *args, **kwargs)[key]
+
+            def logcall(args, kwargs):
                 try:
-                    callargs = inspect.getcallargs(func, *args, **kwargs)
-                    names = []
-                    if "self" in callargs:
-                        _class = callargs["self"].__class__
-                        names.append(_class.__module__)
-                        names.append(_class.__name__)
+                    if selfpos is not None and (selfpos < len(args) or
+                                                "self" in kwargs):
+                        _class = argument("self", args, kwargs).__class__
+                        funcname = "%s.%s.%s" % (_class.__module__,
+                                                 _class.__name__,
+                                                 func.__name__)
                     else:
-                        names.append(func.__module__)
-                    names.append(func.__name__)
-                    funcname = ".".join(names)
+                        funcname = modname
                     self.log("FuncLogger: [%s] was called", funcname)
 
-                    if printkey:
-                        keys = printkey
-                        if not isinstance(printkey, (list, tuple)):
-                            keys = [printkey]
-                        for key in keys:
-                            value = callargs[key]
-                            self.log("   |______: with argument %s => %s",
-                                     key, repr(value))
-                    
+                    for key in keys:
+                        value = argument(key, args, kwargs)
+                        self.log("   |______: with argument %s => %s",
+                                 key, repr(value))
+
                     if withcaller:
-                        funcname = caller_name(2)
+                        funcname = caller(2)
                         self.log("   |______: caller is [%s]", funcname)
 
                 except Exception as e:
                     self.log("FuncLogger Error: %s", e)
-                finally:
+
+            @wraps(func)
+            def decoed(*args, **kwargs):
+                if logger.isEnabledFor(level) and (sampled is None or
+                                                   sampled()):
+                    logcall(args, kwargs)
+                if stats is None:
                     return func(*args, **kwargs)
+
+                wall, cpu = _wallclock(), _cpuclock()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    stats.record(_wallclock() - wall, _cpuclock() - cpu)
+                    if self.flush_interval is not None:
+                        self._maybe_flush()
             return decoed
         return deco_func
 
 
+# (code对象, self的类) => 名字
+_frame_names = {}
+
+
+def frame_name(frame):
+    """ 返回frame对应的module.class.method名字，结果按code对象缓存 """
+    code = frame.f_code
+    cls = None
+    # 访问f_locals的代价比较大，先确认函数里有self这个变量
+    if "self" in code.co_varnames:
+        # I don't know any way to detect call from the object method
+        # XXX: there seems to be no way to detect static method call - it will
+        #      be just a function call
+        obj = frame.f_locals.get("self", _frame_names)
+        if obj is not _frame_names:
+            cls = obj.__class__
+    key = (code, cls)
+    name = _frame_names.get(key)
+    if name is None:
+        parts = []
+        modname = frame.f_globals.get("__name__")
+        if modname:
+            parts.append(modname)
+        if cls is not None:
+            parts.append(cls.__name__)
+        if code.co_name != "<module>":  # top level usually
+            parts.append(code.co_name)  # function or a method
+        name = _frame_names[key] = ".".join(parts)
+    return name
+
+
+def caller(depth=1):
+    """ 返回调用者的名字，格式为module.class.method
+    depth=1表示调用当前函数的函数，depth=2表示再往上一层，以此类推，
+    超出调用栈时返回空字符串
+    """
+    try:
+        frame = sys._getframe(depth + 1)
+    except ValueError:
+        return ""
+    try:
+        return frame_name(frame)
+    finally:
+        del frame
+
+
 def caller_name(skip=2):
     """Get a name of a caller in the format module.class.method
 
@@ -96,26 +524,11 @@ def caller_name(skip=2):
 
        from https://gist.github.com/2151727
     """
-    stack = inspect.stack()
-    start = 0 + skip
-    if len(stack) < start + 1:
+    try:
+        parentframe = sys._getframe(skip)
+    except ValueError:
         return ''
-    parentframe = stack[start][0]    
-
-    name = []
-    module = inspect.getmodule(parentframe)
-    # `modname` can be None when frame is executed directly in console
-    # TODO(techtonik): consider using __main__
-    if module:
-        name.append(module.__name__)
-    # detect classname
-    if 'self' in parentframe.f_locals:
-        # I don't know any way to detect call from the object method
-        # XXX: there seems to be no way to detect static method call - it will
-        #      be just a function call
-        name.append(parentframe.f_locals['self'].__class__.__name__)
-    codename = parentframe.f_code.co_name
-    if codename != '<module>':  # top level usually
-        name.append(codename)  # function or a method
-    del parentframe
-    return ".".join(name)
+    try:
+        return frame_name(parentframe)
+    finally:
+        del parentframe
@@ -1,17 +1,45 @@
 # -*- coding: utf-8 -*-
-import os
 import json
+import time
+import base64
+import sqlite3
+import threading
 import sqlalchemy
 import sqlalchemy.orm
 from math import ceil
-from datetime import datetime
-from sqlalchemy import create_engine, event
-from sqlalchemy.orm import sessionmaker, scoped_session
+from itertools import islice
+from operator import attrgetter
+from collections import OrderedDict
+from decimal import Decimal
+from datetime import datetime, date
+from sqlalchemy import create_engine, event, and_, or_, func, text, \
+    bindparam, false
+from sqlalchemy.sql import operators
+from sqlalchemy.sql.util import find_tables
+from sqlalchemy.sql.expression import UnaryExpression
+from sqlalchemy.orm import sessionmaker, scoped_session, loading
 from sqlalchemy.orm.exc import UnmappedClassError
+from sqlalchemy.orm.events import SessionEvents
 from sqlalchemy.ext.declarative import declarative_base
+from .archive import DeletedArchiver
+from .pool import PoolStats
+from .routing import ReplicaRouter, RoutingSession, WRITTEN_TABLES, \
+    BIND_OPTION
+from .cache import QueryCache, LRUBackend, DBMBackend
+from .profiler import QueryProfiler
 
 
-__all__ = ["SQLAlchemy", "BaseQuery", "PageNotFound"]
+__all__ = ["SQLAlchemy", "BaseQuery", "PageNotFound", "ExactCount",
+           "CachedCount", "EstimatedCount", "NoCount", "WindowCount",
+           "DeletedArchiver", "PoolStats", "ReplicaRouter", "QueryCache",
+           "LRUBackend", "DBMBackend", "QueryProfiler"]
+
+# `session.info`中保存缓存区域的key
+CACHE_REGIONS = "moon_cache_regions"
+# 查询的execution_options中保存缓存的(区域, ttl)，见:method:`BaseQuery.cached`
+CACHE_OPTION = "moon_cache"
+# SQLAlchemy 1.4+的Query通过`Session.execute`执行，不经过`Query.__iter__`
+_ORM_EXECUTE = hasattr(SessionEvents, "do_orm_execute")
 
 
 # 封装sqlalchemy的使用
@@ -26,16 +54,28 @@ def _include_sqlalchemy(obj):
 
 
 class Pagination(object):
-    """ 分页组件 """
-    def __init__(self, query, page_num, per_page, total, items):
+    """ 分页组件
+    total_kind: 总数的来源，"exact"/"cached"/"estimated"，不计算总数时为None
+    """
+    def __init__(self, query, page_num, per_page, total, items,
+                 total_kind="exact", has_next=None, count=None):
         self.query = query
         self.page_num = page_num
         self.per_page = per_page
         self.items = items
         self.total = total
+        self.total_kind = total_kind
+        self.count = count
+        self._has_next = has_next
+
+    @property
+    def total_exact(self):
+        return self.total_kind == "exact"
 
     @property
     def pages(self):
+        if self.total is None:
+            return None
         if self.per_page == 0:
             pages = 0
         else:
@@ -45,7 +85,8 @@ class Pagination(object):
     def prev(self, error_out=False):
         assert self.query is not None, "a query object is required " \
                                        "for this method work."
-        return self.query.paginate(self.page_num-1, self.per_page, error_out)
+        return self.query.paginate(self.page_num-1, self.per_page, error_out,
+                                   count=self.count)
 
     @property
     def prev_num(self):
@@ -58,7 +99,8 @@ class Pagination(object):
     def next(self, error_out=False):
         assert self.query is not None, "a query object is required " \
                                        "for this method work."
-        return self.query.paginate(self.page_num+1, self.per_page, error_out)
+        return self.query.paginate(self.page_num+1, self.per_page, error_out,
+                                   count=self.count)
 
     @property
     def next_num(self):
@@ -66,31 +108,691 @@ class Pagination(object):
 
     @property
     def has_next(self):
+        if self._has_next is not None:
+            return self._has_next
         return self.page_num < self.pages
 
 
+class SeekPagination(Pagination):
+    """ 基于游标(keyset)的分页组件
+    不知道总数和页码，通过`next_cursor`和`prev_cursor`前后翻页
+    """
+    def __init__(self, query, order_columns, per_page, items,
+                 next_cursor=None, prev_cursor=None):
+        super(SeekPagination, self).__init__(query, None, per_page,
+                                             None, items, total_kind=None)
+        self.order_columns = order_columns
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    def prev(self, error_out=False):
+        assert self.query is not None, "a query object is required " \
+                                       "for this method work."
+        return self.query.seek_paginate(self.order_columns, self.per_page,
+                                        before=self.prev_cursor,
+                                        error_out=error_out)
+
+    @property
+    def prev_num(self):
+        return None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    def next(self, error_out=False):
+        assert self.query is not None, "a query object is required " \
+                                       "for this method work."
+        return self.query.seek_paginate(self.order_columns, self.per_page,
+                                        after=self.next_cursor,
+                                        error_out=error_out)
+
+    @property
+    def next_num(self):
+        return None
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+def _seek_key(column):
+    """ 把排序表达式拆分为(列, 是否降序, 是否可能为NULL)
+    只有声明了`nullable`的列才会按可能为NULL处理
+    """
+    desc = False
+    if isinstance(column, UnaryExpression):
+        if column.modifier is operators.desc_op:
+            column, desc = column.element, True
+        elif column.modifier is operators.asc_op:
+            column = column.element
+    expression = getattr(column, "expression", column)
+    return column, desc, bool(getattr(expression, "nullable", False))
+
+
+def _seek_order(keys, backward):
+    """ 排序条件，可能为NULL的列把NULL当作最大的值，
+    各个数据库中NULL的默认位置不同，这里明确指定
+    """
+    order = []
+    for column, desc, nullable in keys:
+        descending = desc != backward
+        if nullable:
+            isnull = column.is_(None)
+            order.append(isnull.desc() if descending else isnull.asc())
+        order.append(column.desc() if descending else column.asc())
+    return order
+
+
+def _seek_compare(column, value, nullable, greater):
+    """ 把NULL当作最大值时的`column > value`或者`column < value`，
+    不可能成立时返回None
+    """
+    if greater:
+        if value is None:
+            return None
+        if nullable:
+            return or_(column > value, column.is_(None))
+        return column > value
+    if value is None:
+        return column.isnot(None)
+    return column < value
+
+
+def _seek_clause(keys, values, backward):
+    """ 生成游标之后(或之前)的过滤条件，支持多列和混合的排序方向
+    (a > x) OR (a = x AND b < y) OR ...
+    """
+    clauses = []
+    for i, (column, desc, nullable) in enumerate(keys):
+        cond = _seek_compare(column, values[i], nullable, desc == backward)
+        if cond is None:
+            continue
+        conds = [keys[j][0].is_(None) if values[j] is None
+                 else keys[j][0] == values[j] for j in range(i)]
+        clauses.append(and_(*(conds + [cond])))
+    return or_(*clauses) if clauses else false()
+
+
+def _cursor_default(obj):
+    if isinstance(obj, datetime):
+        return {"__datetime__": list(obj.timetuple()[:6]) + [obj.microsecond]}
+    if isinstance(obj, date):
+        return {"__date__": [obj.year, obj.month, obj.day]}
+    if isinstance(obj, Decimal):
+        return {"__decimal__": str(obj)}
+    raise TypeError("%r is not cursor serializable" % obj)
+
+
+def _cursor_hook(dct):
+    if "__datetime__" in dct:
+        return datetime(*dct["__datetime__"])
+    if "__date__" in dct:
+        return date(*dct["__date__"])
+    if "__decimal__" in dct:
+        return Decimal(dct["__decimal__"])
+    return dct
+
+
+def encode_cursor(values):
+    """ 把排序列的值编码为不透明的游标字符串 """
+    data = json.dumps(list(values), default=_cursor_default,
+                      separators=(",", ":"))
+    return base64.urlsafe_b64encode(data.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    """ 解码游标，游标不合法时抛出:class:`PageNotFound` """
+    try:
+        if not isinstance(cursor, bytes):
+            cursor = cursor.encode("ascii")
+        data = base64.urlsafe_b64decode(cursor).decode("utf-8")
+        values = json.loads(data, object_hook=_cursor_hook)
+    except (TypeError, ValueError):
+        raise PageNotFound("invalid cursor")
+    if not isinstance(values, list):
+        raise PageNotFound("invalid cursor")
+    return values
+
+
+# 分页时计算总数的策略
+###############################################################################
+def _statement_key(query):
+    """ 用编译后的SQL和参数作为查询的key """
+    compiled = query.statement.compile(bind=query.session.get_bind())
+    return str(compiled), repr(sorted(compiled.params.items()))
+
+
+def _orm_execute_cached(state):
+    """ SQLAlchemy 1.4+在do_orm_execute事件中读写`BaseQuery.cached`的缓存 """
+    options = state.execution_options.get(CACHE_OPTION)
+    session = state.session
+    if options is None or not state.is_select or _cache_bypassed(session):
+        return None
+    region, ttl = options
+    cache = session.info[CACHE_REGIONS][region]
+    statement = state.statement
+    compiled = statement.compile(bind=session.get_bind(**state.bind_arguments))
+    descs = getattr(statement, "column_descriptions", None) or ()
+    key = (str(compiled), repr(sorted(compiled.params.items())),
+           repr(sorted((state.parameters or {}).items())),
+           repr([d["name"] for d in descs]))
+
+    frozen = cache.get(key)
+    if frozen is not None:
+        return loading.merge_frozen_result(session, statement, frozen,
+                                           load=False)()
+    tables = set(t.name for t in find_tables(statement))
+    stamp = cache.stamp(tables)
+    frozen = state.invoke_statement().freeze()
+    cache.set(key, frozen, tables, ttl, stamp)
+    return frozen()
+
+
+class ExactCount(object):
+    """ 使用`COUNT`精确计算总数 """
+    need_total = True
+    in_page = False
+
+    def count(self, query):
+        """ 返回(总数, 总数的来源) """
+        return query.order_by(None).count(), "exact"
+
+
+class CachedCount(ExactCount):
+    """ 缓存总数，以编译后的SQL和参数作为key，LRU淘汰并且有过期时间
+        maxsize: 最多缓存的条数
+        ttl: 缓存有效的秒数
+    """
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def count(self, query):
+        query = query.order_by(None)
+        key = _statement_key(query)
+        now = time.time()
+        with self._lock:
+            hit = self._cache.pop(key, None)
+            if hit is not None and hit[1] > now:
+                self._cache[key] = hit
+                return hit[0], "cached"
+
+        total, kind = super(CachedCount, self).count(query)
+        with self._lock:
+            self._cache[key] = (total, now + self.ttl)
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+        return total, kind
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+class EstimatedCount(ExactCount):
+    """ 读取数据库查询计划中估算的行数(PostgreSQL/MySQL)
+        估算值小于`min_exact`或者数据库不支持时，回退到精确计算(例如SQLite)
+    EXPLAIN在单独的连接上执行，出错时不会影响session的事务
+    """
+    def __init__(self, min_exact=1000):
+        self.min_exact = min_exact
+
+    def count(self, query):
+        query = query.order_by(None)
+        try:
+            estimated = self.estimate(query)
+        except sqlalchemy.exc.DBAPIError:
+            estimated = None
+        if estimated is None or estimated < self.min_exact:
+            return super(EstimatedCount, self).count(query)
+        return estimated, "estimated"
+
+    def estimate(self, query):
+        """ 返回估算的行数，无法估算时返回None """
+        bind = query.session.get_bind(clause=query.statement)
+        name = bind.dialect.name
+        if name == "postgresql":
+            prefix = "EXPLAIN (FORMAT JSON) "
+        elif name == "mysql":
+            prefix = "EXPLAIN "
+        else:
+            return None
+
+        compiled = query.statement.compile(bind=bind)
+        if compiled.positional:
+            params = tuple(compiled.params[k] for k in compiled.positiontup)
+        else:
+            params = compiled.params
+        # PostgreSQL中语句出错会中止整个事务，不能使用session的连接
+        with bind.connect() as conn:
+            # 语句已经按照数据库的参数格式编译，直接交给DBAPI执行
+            execute = getattr(conn, "exec_driver_sql", conn.execute)
+            result = execute(prefix + str(compiled), params)
+            keys = list(result.keys())
+            rows = result.fetchall()
+
+        if name == "postgresql":
+            plan = rows[0][0]
+            if not isinstance(plan, list):
+                plan = json.loads(plan)
+            return int(plan[0]["Plan"]["Plan Rows"])
+
+        # 有join或者子查询时每张表一行，无法简单地合并出结果行数
+        if len(rows) != 1:
+            return None
+        row = dict(zip(keys, rows[0]))
+        rows = row.get("rows") or 0
+        filtered = row.get("filtered")
+        if filtered is not None:
+            rows = rows * float(filtered) / 100
+        return int(rows)
+
+
+class NoCount(ExactCount):
+    """ 不计算总数，多取一条数据来判断是否还有下一页 """
+    need_total = False
+
+    def count(self, query):
+        return None, None
+
+
+class WindowCount(ExactCount):
+    """ 用`COUNT(*) OVER ()`在取分页数据的同一条语句中得到总数
+        数据库不支持窗口函数时，回退到单独的`COUNT`查询
+    """
+    in_page = True
+
+
+def _supports_window(dialect):
+    """ 数据库是否支持窗口函数 """
+    name = dialect.name
+    if name in ("postgresql", "oracle", "mssql"):
+        return True
+    if name == "sqlite":
+        return sqlite3.sqlite_version_info >= (3, 25, 0)
+    if name == "mysql":
+        version = dialect.server_version_info or ()
+        if getattr(dialect, "_is_mariadb", False):
+            return version >= (10, 2)
+        return version >= (8, 0)
+    return False
+
+
+# 预加载的方式
+_LOADERS = {
+    "joined": "joinedload",
+    "selectin": "selectinload",
+    "subquery": "subqueryload",
+    "immediate": "immediateload",
+    "lazy": "lazyload",
+    "noload": "noload",
+    "raise": "raiseload",
+}
+
+
+def _preset_options(entity, preset):
+    """ 把`{"author.profile": "joined"}`形式的preset转换为query的options """
+    options = []
+    for path, strategy in preset.items():
+        names = path.split(".")
+        option, cls = sqlalchemy.orm, entity
+        for i, name in enumerate(names):
+            attr = getattr(cls, name)
+            loader = _LOADERS[strategy] if i == len(names) - 1 \
+                else "defaultload"
+            option = getattr(option, loader)(attr)
+            cls = attr.property.mapper.class_
+        options.append(option)
+    return options
+
+
+def _is_instance(obj):
+    state = sqlalchemy.inspect(obj, False)
+    return state is not None and hasattr(state, "mapper")
+
+
+def _is_sliced_or_ordered(query):
+    """ query是否使用了LIMIT/OFFSET或者指定了排序 """
+    statement = query.statement
+    order_by = getattr(statement, "_order_by_clauses", None)
+    if order_by is None:
+        # SQLAlchemy 1.3
+        order_by = statement._order_by_clause.clauses
+    return bool(order_by) or statement._limit_clause is not None or \
+        statement._offset_clause is not None
+
+
+def _cache_bypassed(session):
+    """ 当前事务中写入过或者有未flush的修改时，查询结果可能包含未提交的数据，
+    不能读写共享的缓存
+    """
+    return bool(session.info.get(WRITTEN_TABLES) or session.new or
+                session.dirty or session.deleted)
+
+
+def _expunge(session, items):
+    """ 把处理完的对象从session中移除 """
+    for item in items:
+        for obj in (item if isinstance(item, tuple) else (item,)):
+            state = sqlalchemy.inspect(obj, False)
+            if state is not None and state.session_id is not None:
+                session.expunge(obj)
+
+
 class BaseQuery(sqlalchemy.orm.Query):
     """ 扩展默认:class:`query`，添加:method:`paginate`方法 """
-    def paginate(self, page_num, per_page, error_out=False):
+    # 默认的总数计算策略
+    count_strategy = ExactCount()
+    # 已经使用的预加载preset，见:method:`with_preset`
+    _preset = None
+    # 分页时依次尝试使用的preset
+    paginate_presets = ("list", "default")
+
+    def with_preset(self, name):
+        """ 使用Model的`_load_presets`中定义的预加载方式，例如
+            _load_presets = {
+                "list": {"author": "joined", "tags": "selectin"},
+            }
+        """
+        entity = self.column_descriptions[0]["entity"]
+        presets = getattr(entity, "_load_presets", None) or {}
+        if name not in presets:
+            raise ValueError("%s has no load preset %r"
+                             % (entity.__name__, name))
+        query = self.options(*_preset_options(entity, presets[name]))
+        query._preset = name
+        return query
+
+    def _list_query(self):
+        """ 分页使用的query，没有指定preset时使用`paginate_presets` """
+        if self._preset is not None:
+            return self
+        entity = self._single_entity()
+        presets = getattr(entity, "_load_presets", None) or {}
+        for name in self.paginate_presets:
+            if name in presets:
+                return self.with_preset(name)
+        return self
+
+    def cached(self, ttl=None, region="default"):
+        """ 缓存查询结果，以编译后的SQL和参数作为key
+        命中时ORM对象会merge到当前session中，不会再查询数据库
+        @ttl: 有效秒数，默认使用区域的设置
+        @region: `SQLAlchemy.cache_regions`中的缓存区域
+        """
+        return self.execution_options(**{CACHE_OPTION: (region, ttl)})
+
+    def __iter__(self):
+        options = self.get_execution_options().get(CACHE_OPTION)
+        if options is None or _ORM_EXECUTE:
+            return super(BaseQuery, self).__iter__()
+        return iter(self._cached_results(*options))
+
+    def _cached_results(self, region, ttl):
+        if _cache_bypassed(self.session):
+            return list(super(BaseQuery, self).__iter__())
+        cache = self.session.info[CACHE_REGIONS][region]
+        key = _statement_key(self) + \
+            (repr([d["name"] for d in self.column_descriptions]),)
+        result = cache.get(key)
+        if result is not None:
+            return [self._merge_cached(row) for row in result]
+
+        tables = set(t.name for t in find_tables(self.statement))
+        stamp = cache.stamp(tables)
+        result = list(super(BaseQuery, self).__iter__())
+        cache.set(key, result, tables, ttl, stamp)
+        return result
+
+    def _merge_cached(self, row):
+        """ 把缓存中的对象merge到当前session """
+        merge = self.session.merge
+        if isinstance(row, tuple):
+            if any(_is_instance(v) for v in row):
+                values = [merge(v, load=False) if _is_instance(v) else v
+                          for v in row]
+                return row.__class__(values, row.keys())
+            return row
+        if _is_instance(row):
+            return merge(row, load=False)
+        return row
+
+    def using(self, name):
+        """ 指定查询使用的数据库，"primary"为主库，"replica"为任意从库，
+        或者从库的名字
+        """
+        return self.execution_options(**{BIND_OPTION: name})
+
+    def _connection_from_session(self, **kw):
+        # SQLAlchemy 1.3的Query不会把execution_options交给`get_bind`，
+        # 通过`Session.connection`的额外参数传入，1.4不会调用这个方法
+        name = self.get_execution_options().get(BIND_OPTION)
+        if name is not None:
+            kw[BIND_OPTION] = name
+        return super(BaseQuery, self)._connection_from_session(**kw)
+
+    def paginate(self, page_num, per_page, error_out=False, count=None):
         """
         @error_out: 当没有元素的时候，是否raise
+        @count: 计算总数的策略，默认为`count_strategy`
         返回一个:class:`Pagination`对象
         """
+        query = self._list_query()
+        if query is not self:
+            return query.paginate(page_num, per_page, error_out, count)
+
         error_out = PageNotFound if error_out is True else error_out
+        count = count or self.count_strategy
         if page_num < 1 and error_out:
             raise error_out
-        items = self.limit(per_page) \
+
+        if count.in_page and not self._distinct and \
+           _supports_window(self.session.get_bind().dialect):
+            return self._paginate_window(page_num, per_page, error_out, count)
+
+        limit = per_page if count.need_total else per_page + 1
+        items = self.limit(limit) \
             .offset((page_num - 1) * per_page).all()
 
         if not items and page_num != 1 and error_out:
             raise error_out
 
-        if page_num == 1 and len(items) < per_page:
-            total = len(items)
+        has_next = None
+        if not count.need_total:
+            has_next = len(items) > per_page
+            items = items[:per_page]
+            total, total_kind = count.count(self)
+        elif page_num == 1 and len(items) < per_page:
+            total, total_kind = len(items), "exact"
+        else:
+            total, total_kind = count.count(self)
+
+        return Pagination(self, page_num, per_page, total, items,
+                          total_kind, has_next, count)
+
+    def _paginate_window(self, page_num, per_page, error_out, count):
+        """ 一条语句同时取出分页数据和总数 """
+        nentities = len(self.column_descriptions)
+        rows = self.add_columns(func.count().over()).limit(per_page) \
+            .offset((page_num - 1) * per_page).all()
+
+        if not rows and page_num != 1 and error_out:
+            raise error_out
+
+        if rows:
+            total, total_kind = rows[0][-1], "exact"
+        elif page_num == 1:
+            total, total_kind = 0, "exact"
+        else:
+            # 超出最后一页时取不到总数
+            total, total_kind = count.count(self)
+
+        if nentities == 1:
+            items = [row[0] for row in rows]
+        else:
+            items = [tuple(row[:nentities]) for row in rows]
+
+        return Pagination(self, page_num, per_page, total, items,
+                          total_kind, None, count)
+
+    def _single_entity(self):
+        """ 只查询一个Model时返回这个Model，否则返回None """
+        descs = self.column_descriptions
+        if len(descs) == 1 and descs[0]["type"] is descs[0]["entity"]:
+            return descs[0]["entity"]
+        return None
+
+    def as_dicts(self, *keys):
+        """
+        只查询需要的列，直接从结果行生成dict，不创建ORM对象
+        结果和`Model.to_dict(*keys)`相同
+        """
+        entity = self._single_entity()
+        assert entity is not None, "as_dicts only works on single " \
+                                   "model query."
+        names, _ = entity._serializer(keys)
+        columns = [entity.__table__.columns[name] for name in names]
+        result = self.session.execute(self.with_entities(*columns).statement)
+        return [dict(zip(names, row)) for row in result]
+
+    def iter_chunks(self, size=1000, expunge=True):
+        """
+        分块遍历查询结果，每次返回最多`size`条的list
+        单主键的单实体查询按主键区间遍历，其他查询以及指定了排序或者
+        LIMIT/OFFSET的查询使用服务端游标
+        @expunge: 每块处理完后把对象从session中移除，避免identity map无限增长，
+                  对象上未flush的修改会丢失
+        """
+        pk = None
+        entity = self._single_entity()
+        if entity is not None and not _is_sliced_or_ordered(self):
+            mapper = sqlalchemy.inspect(entity)
+            if len(mapper.primary_key) == 1:
+                prop = mapper.get_property_by_column(mapper.primary_key[0])
+                pk = getattr(entity, prop.key)
+
+        if pk is not None:
+            chunks = self._iter_pk_chunks(pk, size)
+        else:
+            chunks = self._iter_stream_chunks(size)
+
+        for chunk in chunks:
+            yield chunk
+            if expunge:
+                _expunge(self.session, chunk)
+
+    def _iter_pk_chunks(self, pk, size):
+        query = self.order_by(None).order_by(pk)
+        last = None
+        while True:
+            if last is None:
+                chunk = query.limit(size).all()
+            else:
+                chunk = query.filter(pk > last).limit(size).all()
+            if not chunk:
+                return
+            last = getattr(chunk[-1], pk.key)
+            yield chunk
+            if len(chunk) < size:
+                return
+
+    def _iter_stream_chunks(self, size):
+        chunk = []
+        for item in self.yield_per(size):
+            chunk.append(item)
+            if len(chunk) >= size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def iter_rows(self, size=1000):
+        """
+        使用服务端游标逐行遍历，返回的是行数据而不是ORM对象，
+        需要部分字段时配合`with_entities`使用
+        """
+        statement = self.statement.execution_options(
+            stream_results=True, **self.get_execution_options())
+        # 直接在连接上执行，SQLAlchemy 1.4的session会把结果转换为ORM对象
+        bind = self.session.get_bind(clause=statement)
+        result = self.session.connection(bind=bind).execute(statement)
+        try:
+            while True:
+                rows = result.fetchmany(size)
+                if not rows:
+                    return
+                for row in rows:
+                    yield row
+        finally:
+            result.close()
+
+    def seek_paginate(self, order_columns, per_page, after=None, before=None,
+                      error_out=False):
+        """
+        基于游标的分页，每一页的代价都和第一页相同
+        @order_columns: 排序列，例如`(Model.ctime.desc(), Model.id)`，
+                        组合起来必须唯一(一般把主键放在最后)，
+                        `nullable`的列中NULL排在最大的位置，这样的列无法使用
+                        普通的索引排序，尽量声明为`nullable=False`；
+                        不是列的表达式(例如函数)按不为NULL处理
+        @after/before: 上一页返回的`next_cursor`/`prev_cursor`
+        @error_out: 当没有元素的时候，是否raise
+        返回一个:class:`SeekPagination`对象
+        """
+        query = self._list_query()
+        if query is not self:
+            return query.seek_paginate(order_columns, per_page, after,
+                                       before, error_out)
+
+        error_out = PageNotFound if error_out is True else error_out
+        if after is not None and before is not None:
+            raise ValueError("after and before can not be used together")
+        if not isinstance(order_columns, (list, tuple)):
+            order_columns = (order_columns,)
+        keys = [_seek_key(c) for c in order_columns]
+        backward = before is not None
+        cursor = before if backward else after
+
+        # 排序列作为额外的列一起查出，取完游标之后去掉
+        nentities = len(self.column_descriptions)
+        query = self.add_columns(*[key[0] for key in keys])
+        if cursor is not None:
+            values = decode_cursor(cursor)
+            if len(values) != len(keys):
+                raise PageNotFound("invalid cursor")
+            query = query.filter(_seek_clause(keys, values, backward))
+        query = query.order_by(None).order_by(*_seek_order(keys, backward))
+        rows = query.limit(per_page + 1).all()
+
+        more = len(rows) > per_page
+        rows = rows[:per_page]
+        if backward:
+            rows.reverse()
+
+        if not rows and cursor is not None and error_out:
+            raise error_out
+
+        if nentities == 1:
+            items = [row[0] for row in rows]
         else:
-            total = self.order_by(None).count()
+            items = [tuple(row[:nentities]) for row in rows]
 
-        return Pagination(self, page_num, per_page, total, items)
+        next_cursor = prev_cursor = None
+        if rows:
+            first = encode_cursor(rows[0][nentities:])
+            last = encode_cursor(rows[-1][nentities:])
+            if backward:
+                prev_cursor = first if more else None
+                next_cursor = last
+            else:
+                prev_cursor = first if cursor is not None else None
+                next_cursor = last if more else None
+
+        return SeekPagination(self, order_columns, per_page, items,
+                              next_cursor, prev_cursor)
 
 
 class _QueryProperty(object):
@@ -111,13 +813,36 @@ class Model(object):
     query_class = BaseQuery
     query = None
 
+    @classmethod
+    def _serializer(cls, keys):
+        """ 返回(列名, 取值函数)，每个Model和keys的组合只生成一次 """
+        cache = cls.__dict__.get("_serializers")
+        if cache is None:
+            cache = {}
+            setattr(cls, "_serializers", cache)
+        ckey = frozenset(keys)
+        serializer = cache.get(ckey)
+        if serializer is None:
+            names = tuple(c.name for c in cls.__table__.columns
+                          if not keys or c.name in ckey)
+            if len(names) == 1:
+                getter = lambda obj, name=names[0]: (getattr(obj, name),)
+            elif names:
+                getter = attrgetter(*names)
+            else:
+                getter = lambda obj: ()
+            serializer = cache[ckey] = (names, getter)
+        return serializer
+
     def to_dict(self, *keys):
-        dct = {}
-        for column in self.__table__.columns:
-            cname = column.name
-            if not keys or cname in keys:
-                dct[column.name] = getattr(self, column.name)
-        return dct
+        names, getter = self._serializer(keys)
+        return dict(zip(names, getter(self)))
+
+    @classmethod
+    def dicts(cls, objects, *keys):
+        """ 批量转换为dict """
+        names, getter = cls._serializer(keys)
+        return [dict(zip(names, getter(obj))) for obj in objects]
 
     def cs_update(self, **kwargs):
         """ 批量修改属性值
@@ -139,49 +864,276 @@ class Model(object):
         return u"<{}: {}>".format(self.__class__.__name__, id(self))
 
 
-class SQLAlchemy(object):
-    """ 对sqlalchemy使用的封装 """
+def _batches(rows, size):
+    """ 把rows切分成最多`size`条的list """
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _touch(model, rows):
+    """ 和`cs_update`一样，自动更新`update_time` """
+    if "update_time" not in model.__table__.columns:
+        return rows
+    now = datetime.utcnow()
+    return [dict(row, update_time=now) for row in rows]
+
+
+class _SQLAlchemyBase(object):
+    """ 同步和asyncio版本共用的部分：Model和session """
     _Session = None
+    pool_stats = None
 
-    def __init__(self, dump_deleted=None):
+    def __init__(self):
         _include_sqlalchemy(self)
         self.Model = self.make_declarative_base()
+
+    def make_declarative_base(self):
+        return declarative_base(cls=Model, name="Model")
+
+    @property
+    def session(self):
+        return self._Session
+
+
+class SQLAlchemy(_SQLAlchemyBase):
+    """ 对sqlalchemy使用的封装 """
+    router = None
+    profiler = None
+
+    def __init__(self, dump_deleted=None):
+        """
+        :dump_deleted: 归档删除对象的目录或者:class:`DeletedArchiver`，
+                       只归档`_dump_deleted`为True的Model
+        """
+        super(SQLAlchemy, self).__init__()
+        # `BaseQuery.cached`使用的缓存区域
+        self.cache_regions = {"default": QueryCache()}
+        if dump_deleted and not isinstance(dump_deleted, DeletedArchiver):
+            dump_deleted = DeletedArchiver(dump_deleted)
         self.dump_deleted = dump_deleted
 
     def make_declarative_base(self):
-        base = declarative_base(cls=Model, name="Model")
+        base = super(SQLAlchemy, self).make_declarative_base()
         base.query = _QueryProperty(self)
         return base
 
-    def _setup_dump_deleted(self):
-        # TODO 需要研究清楚 (hongbo @ 2014-01-23 18:40)
+    def _setup_dump_deleted(self, session_factory):
+        """ flush时记录删除的对象，提交之后交给后台线程写入，回滚则丢弃
+        `Query.delete()`这样的批量删除不会被记录
+        """
         if not self.dump_deleted:
             return
+        archiver = self.dump_deleted
 
-        def dump_object(obj):
-            fn = obj._dump_id()
-            ffn = os.path.join(self.dump_deleted, fn)
-            with open(ffn, "w") as f:
-                json.dump(obj.to_dict(), f)
+        @event.listens_for(session_factory, "after_flush")
+        def after_flush(session, flush_context):
+            # after_flush中session.deleted仍然是flush之前的状态
+            records = [{
+                "table": obj.__tablename__,
+                "deleted_at": datetime.utcnow(),
+                "data": obj.to_dict(),
+            } for obj in session.deleted if getattr(obj, "_dump_deleted", 0)]
+            if records:
+                session.info.setdefault("dump_deleted", []).extend(records)
 
-        @event.listen_for(self._Session, "before_commit")
-        def before_commit(session):
-            for model, operation in session._model_changes.values():
-                if model._dump_deleted and operation == "delete":
-                    dump_object(model)
+        @event.listens_for(session_factory, "after_commit")
+        def after_commit(session):
+            archiver.put(session.info.pop("dump_deleted", None))
 
-    @property
-    def session(self):
-        return self._Session
+        @event.listens_for(session_factory, "after_transaction_end")
+        def after_transaction_end(session, transaction):
+            # 提交时after_commit已经取走了记录，剩下的都是回滚的，
+            # `close()`中的回滚没有after_rollback事件
+            if transaction.parent is None:
+                session.info.pop("dump_deleted", None)
 
-    def use_scoped_session(self, engine=None, sa_url=None, sa_echo=False):
+    def _setup_cache_invalidation(self, session_factory):
+        """ 事务结束之后删除涉及修改过的表的查询缓存
+        回滚时也需要删除：共用连接(例如SQLite)的其他session可能已经缓存了
+        未提交的数据；`close()`时的回滚没有after_rollback事件，
+        所以使用after_transaction_end
+        """
+        @event.listens_for(session_factory, "after_transaction_end")
+        def after_transaction_end(session, transaction):
+            tables = session.info.get(WRITTEN_TABLES)
+            if tables:
+                for cache in self.cache_regions.values():
+                    cache.invalidate_tables(tables)
+
+    def use_scoped_session(self, engine=None, sa_url=None, sa_echo=False,
+                           replicas=None, replica_policy="round_robin",
+                           **engine_options):
+        """
+        :replicas: 只读从库的engine或者url，list或者`{名字: engine}`，
+                   只读查询会分配到从库，见:class:`RoutingSession`
+        :replica_policy: 选择从库的方式，"round_robin"或者"least_busy"
+        :engine_options: 创建engine的其他参数，例如`pool_size`, `max_overflow`,
+                         `pool_recycle`, `pool_pre_ping`, `pool_timeout`
+        连接池的统计数据在`pool_stats`中
+        """
         if not engine:
-            engine = create_engine(sa_url, echo=sa_echo)
+            engine = create_engine(sa_url, echo=sa_echo, **engine_options)
+
+        if isinstance(replicas, dict):
+            replicas = dict(replicas)
+        else:
+            replicas = dict(("replica%d" % i, r)
+                            for i, r in enumerate(replicas or ()))
+        for name, replica in replicas.items():
+            if not isinstance(replica, sqlalchemy.engine.Engine):
+                replicas[name] = create_engine(replica, echo=sa_echo,
+                                               **engine_options)
+        self.router = ReplicaRouter(engine, replicas, replica_policy)
 
-        session_factory = sessionmaker(bind=engine, query_cls=BaseQuery)
+        info = {CACHE_REGIONS: self.cache_regions}
+        session_factory = sessionmaker(bind=engine, query_cls=BaseQuery,
+                                       class_=RoutingSession,
+                                       router=self.router, info=info)
         self._Session = scoped_session(session_factory)
         self._engine = engine
-        self._setup_dump_deleted()
+        self.pool_stats = PoolStats(engine)
+        self._setup_dump_deleted(session_factory)
+        self._setup_cache_invalidation(session_factory)
+        if _ORM_EXECUTE:
+            event.listen(session_factory, "do_orm_execute",
+                         _orm_execute_cached)
+
+    # 批量写入，使用executemany，不经过session的unit of work
+    # 不会提交事务，也不会同步session中已经加载的对象
+    ###########################################################################
+    def bulk_insert(self, model, rows, batch_size=1000):
+        """ 批量插入
+        :rows: dict的序列，key为列名
+        返回插入的行数
+        """
+        insert = model.__table__.insert()
+        count = 0
+        for batch in _batches(rows, batch_size):
+            self.session.execute(insert, batch)
+            count += len(batch)
+        return count
+
+    def bulk_update(self, model, rows, batch_size=1000):
+        """ 按主键批量修改，只修改`_csupdate_keys`中的列
+        :rows: dict的序列，必须包含主键列，没有可以修改的列的行被忽略
+        返回影响的行数
+        """
+        table = model.__table__
+        pks = [c.name for c in table.primary_key.columns]
+        keys = getattr(model, "_csupdate_keys", None)
+        where = and_(*[table.c[pk] == bindparam("_pk_" + pk) for pk in pks])
+        update = table.update().where(where)
+
+        count = 0
+        for batch in _batches(rows, batch_size):
+            # 修改的列相同的行才能放在一次executemany里
+            groups = {}
+            for row in _touch(model, batch):
+                params = dict(("_pk_" + pk, row[pk]) for pk in pks)
+                for k, v in row.items():
+                    if k not in pks and (keys is None or k in keys or
+                                         k == "update_time"):
+                        params[k] = v
+                if len(params) == len(pks):
+                    continue
+                groups.setdefault(frozenset(params), []).append(params)
+            for params in groups.values():
+                result = self.session.execute(update, params)
+                count += result.rowcount
+        return count
+
+    def bulk_upsert(self, model, rows, index_elements=None, update_keys=None,
+                    batch_size=1000):
+        """ 批量插入，冲突时修改已经存在的行
+        :index_elements: 判断冲突的列，默认为主键(MySQL使用表上所有唯一索引)
+        :update_keys: 冲突时修改的列，默认为`_csupdate_keys`或者除冲突列外
+                      的所有列
+        返回数据库报告的影响行数(MySQL修改一行计为2)
+        """
+        table = model.__table__
+        rows = list(rows)
+        if not rows:
+            return 0
+        rows = _touch(model, rows)
+        columns = [c for c in table.columns if c.name in rows[0]]
+        if index_elements is None:
+            index_elements = [c.name for c in table.primary_key.columns]
+        if update_keys is None:
+            update_keys = getattr(model, "_csupdate_keys", None) or \
+                [c.name for c in columns if c.name not in index_elements]
+        update_keys = [k for k in update_keys if k in rows[0]]
+        if "update_time" in rows[0] and "update_time" not in update_keys:
+            update_keys.append("update_time")
+
+        dialect = self.session.get_bind().dialect
+        if dialect.name == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+            stmt = insert(table)
+            if update_keys:
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=index_elements,
+                    set_=dict((k, stmt.excluded[k]) for k in update_keys))
+            else:
+                stmt = stmt.on_conflict_do_nothing(
+                    index_elements=index_elements)
+        elif dialect.name == "mysql":
+            from sqlalchemy.dialects.mysql import insert
+            stmt = insert(table)
+            if update_keys:
+                stmt = stmt.on_duplicate_key_update(
+                    **dict((k, stmt.inserted[k]) for k in update_keys))
+            else:
+                stmt = stmt.prefix_with("IGNORE")
+        elif dialect.name == "sqlite":
+            stmt = self._sqlite_upsert(table, columns, index_elements,
+                                       update_keys, dialect)
+        else:
+            raise NotImplementedError(
+                "bulk_upsert is not supported on %s" % dialect.name)
+        # SQLite的文本语句无法判断修改的表，明确声明
+        stmt = stmt.execution_options(**{WRITTEN_TABLES: (table.name,)})
+
+        count = 0
+        for batch in _batches(rows, batch_size):
+            result = self.session.execute(stmt, batch)
+            count += result.rowcount
+        return count
+
+    def _sqlite_upsert(self, table, columns, index_elements, update_keys,
+                       dialect):
+        """ SQLite(3.24+)的`INSERT ... ON CONFLICT`语句 """
+        quote = dialect.identifier_preparer.quote
+        names = [c.name for c in columns]
+        sql = "INSERT INTO %s (%s) VALUES (%s) ON CONFLICT (%s) " % (
+            dialect.identifier_preparer.format_table(table),
+            ", ".join(quote(n) for n in names),
+            ", ".join(":" + n for n in names),
+            ", ".join(quote(n) for n in index_elements),
+        )
+        if update_keys:
+            sql += "DO UPDATE SET " + ", ".join(
+                "%s = excluded.%s" % (quote(k), quote(k)) for k in update_keys)
+        else:
+            sql += "DO NOTHING"
+        return text(sql).bindparams(
+            *[bindparam(c.name, type_=c.type) for c in columns])
+
+    def enable_profiler(self, **options):
+        """ 统计主库和从库执行的SQL，参数见:class:`QueryProfiler` """
+        self.disable_profiler()
+        self.profiler = QueryProfiler(**options)
+        for engine in [self._engine] + list(self.router.replicas.values()):
+            self.profiler.install(engine)
+        return self.profiler
+
+    def disable_profiler(self):
+        if self.profiler is not None:
+            self.profiler.remove()
+            self.profiler = None
 
     def create_all(self):
         self.Model.metadata.create_all(bind=self._engine)
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+""" asyncio版本的封装，需要Python 3.7+和SQLAlchemy 1.4+
+
+    db = AsyncSQLAlchemy()
+    db.use_async_session(sa_url="postgresql+asyncpg://...")
+    page = await db.paginate(select(User).order_by(User.id), 1, 20)
+    await db.session.remove()
+
+session按asyncio task隔离，task结束前需要调用`session.remove()`
+读写分离、批量写入、profiler、查询缓存和删除归档只在同步版本中支持
+"""
+import asyncio
+from sqlalchemy import select, func
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, \
+    async_scoped_session
+from . import _SQLAlchemyBase, Pagination, PageNotFound, PoolStats
+
+
+__all__ = ["AsyncSQLAlchemy", "AsyncPagination"]
+
+
+class AsyncPagination(Pagination):
+    """ 和:class:`Pagination`相同，但是`prev`和`next`是coroutine """
+    def __init__(self, db, statement, page_num, per_page, total, items):
+        super(AsyncPagination, self).__init__(None, page_num, per_page,
+                                              total, items)
+        self.db = db
+        self.statement = statement
+
+    async def prev(self, error_out=False):
+        return await self.db.paginate(self.statement, self.page_num - 1,
+                                      self.per_page, error_out)
+
+    async def next(self, error_out=False):
+        return await self.db.paginate(self.statement, self.page_num + 1,
+                                      self.per_page, error_out)
+
+
+def _is_single_entity(statement):
+    descs = statement.column_descriptions
+    return len(descs) == 1 and descs[0]["type"] is descs[0]["entity"]
+
+
+class AsyncSQLAlchemy(_SQLAlchemyBase):
+    """ 对sqlalchemy asyncio扩展的封装，Model和同步版本相同
+    没有`Model.query`，使用`select(Model)`构造查询
+    批量写入、profiler、查询缓存和删除归档只在:class:`SQLAlchemy`中提供
+    """
+    def use_async_session(self, engine=None, sa_url=None, sa_echo=False,
+                          **engine_options):
+        """
+        :engine_options: 创建engine的其他参数，例如`pool_size`, `max_overflow`
+        """
+        if not engine:
+            engine = create_async_engine(sa_url, echo=sa_echo,
+                                         **engine_options)
+        session_factory = sessionmaker(bind=engine, class_=AsyncSession,
+                                       expire_on_commit=False)
+        self._Session = async_scoped_session(session_factory,
+                                             scopefunc=asyncio.current_task)
+        self._engine = engine
+        self.pool_stats = PoolStats(engine.sync_engine)
+
+    async def paginate(self, statement, page_num, per_page, error_out=False,
+                       concurrent=True):
+        """
+        @statement: `select()`语句
+        @error_out: 当没有元素的时候，是否raise
+        @concurrent: 在另一个连接上同时查询总数，看不到当前事务中未提交的修改
+        返回一个:class:`AsyncPagination`对象
+        """
+        error_out = PageNotFound if error_out is True else error_out
+        if page_num < 1 and error_out:
+            raise error_out
+
+        count = select(func.count()).select_from(
+            statement.order_by(None).subquery())
+        if concurrent:
+            count_task = asyncio.ensure_future(self._count(count))
+        page = statement.limit(per_page).offset((page_num - 1) * per_page)
+        try:
+            result = await self.session.execute(page)
+        except BaseException:
+            if concurrent:
+                count_task.cancel()
+            raise
+        if _is_single_entity(statement):
+            items = result.scalars().all()
+        else:
+            items = result.all()
+
+        if concurrent:
+            total = await count_task
+        else:
+            total = (await self.session.execute(count)).scalar()
+
+        if not items and page_num != 1 and error_out:
+            raise error_out
+
+        return AsyncPagination(self, statement, page_num, per_page, total,
+                               items)
+
+    async def _count(self, statement):
+        async with self._engine.connect() as conn:
+            return (await conn.execute(statement)).scalar()
+
+    async def create_all(self):
+        async with self._engine.begin() as conn:
+            await conn.run_sync(self.Model.metadata.create_all)
+
+    async def drop_all(self):
+        async with self._engine.begin() as conn:
+            await conn.run_sync(self.Model.metadata.drop_all)
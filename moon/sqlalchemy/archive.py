@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+""" 删除对象的归档，在后台线程中批量写入JSON lines文件 """
+import os
+import gzip
+import json
+import time
+import atexit
+import logging
+import threading
+from decimal import Decimal
+from datetime import datetime, date
+try:
+    from Queue import Queue, Empty
+except ImportError:
+    from queue import Queue, Empty
+
+
+__all__ = ["DeletedArchiver"]
+
+logger = logging.getLogger("moon.sqlalchemy.archive")
+
+
+def _json_default(obj):
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, Decimal):
+        return str(obj)
+    return repr(obj)
+
+
+class DeletedArchiver(object):
+    """ 把删除的对象写入追加模式的JSON lines文件
+        directory: 归档文件所在的目录
+        compress: 是否使用gzip压缩
+        max_bytes: 文件超过这个大小后切换到新文件，0表示不切换
+        batch_size: 每次最多写入多少条
+        interval: 后台线程最长等待多少秒写一次
+    写入出错时记录日志并丢弃这一批记录，后台线程继续运行
+    """
+    filename = "deleted.jsonl"
+
+    def __init__(self, directory, compress=False, max_bytes=64 * 1024 * 1024,
+                 batch_size=1000, interval=1.0):
+        self.directory = directory
+        self.compress = compress
+        self.max_bytes = max_bytes
+        self.batch_size = batch_size
+        self.interval = interval
+        self._queue = Queue()
+        self._thread = None
+        self._registered = False
+        self._lock = threading.Lock()
+
+    @property
+    def path(self):
+        fn = self.filename + (".gz" if self.compress else "")
+        return os.path.join(self.directory, fn)
+
+    def put(self, records):
+        """ 添加一组记录，不等待写入 """
+        if not records:
+            return
+        self._start()
+        self._queue.put(records)
+
+    def flush(self):
+        """ 等待已经添加的记录全部写入 """
+        if self._thread is not None:
+            self._queue.join()
+
+    def close(self):
+        """ 写入剩余的记录并停止后台线程 """
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+
+    def _start(self):
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            return
+        with self._lock:
+            thread = self._thread
+            if thread is None or not thread.is_alive():
+                thread = threading.Thread(target=self._run,
+                                          name="DeletedArchiver")
+                thread.daemon = True
+                thread.start()
+                self._thread = thread
+                if not self._registered:
+                    atexit.register(self.close)
+                    self._registered = True
+
+    def _run(self):
+        stop = False
+        while not stop:
+            records = []
+            ngets = 0
+            try:
+                item = self._queue.get(timeout=self.interval)
+                ngets += 1
+                while True:
+                    if item is None:
+                        stop = True
+                        break
+                    records.extend(item)
+                    if len(records) >= self.batch_size:
+                        break
+                    item = self._queue.get_nowait()
+                    ngets += 1
+            except Empty:
+                pass
+            try:
+                if records:
+                    self._write(records)
+            except Exception:
+                logger.exception("failed to archive %d deleted records to %s",
+                                 len(records), self.path)
+            finally:
+                for _ in range(ngets):
+                    self._queue.task_done()
+
+    def _write(self, records):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        path = self.path
+        if self.max_bytes and os.path.exists(path) and \
+           os.path.getsize(path) >= self.max_bytes:
+            self._rotate(path)
+        data = "".join(json.dumps(r, default=_json_default) + "\n"
+                       for r in records)
+        opener = gzip.open if self.compress else open
+        with opener(path, "ab") as f:
+            f.write(data.encode("utf-8"))
+
+    def _rotate(self, path):
+        suffix = time.strftime("%Y%m%d%H%M%S")
+        base, ext = self.filename.rsplit(".", 1)
+        gz = ".gz" if self.compress else ""
+        target = os.path.join(self.directory,
+                              "%s-%s.%s%s" % (base, suffix, ext, gz))
+        n = 0
+        while os.path.exists(target):
+            n += 1
+            target = os.path.join(self.directory, "%s-%s-%d.%s%s" % (
+                base, suffix, n, ext, gz))
+        os.rename(path, target)
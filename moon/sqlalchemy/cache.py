@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+""" 查询结果的缓存，见:method:`BaseQuery.cached` """
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+try:
+    import anydbm as dbm
+except ImportError:
+    import dbm
+from .routing import ALL_TABLES
+
+
+__all__ = ["QueryCache", "LRUBackend", "DBMBackend"]
+
+
+class LRUBackend(object):
+    """ 进程内的LRU缓存
+        maxsize: 最多缓存的条数
+    """
+    # 淘汰掉一个key之后的回调，由:class:`QueryCache`设置
+    on_evict = None
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """ 返回(值, 过期时间)，不存在时返回None """
+        with self._lock:
+            item = self._data.pop(key, None)
+            if item is not None:
+                self._data[key] = item
+            return item
+
+    def set(self, key, value, expires):
+        evicted = []
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, expires)
+            while len(self._data) > self.maxsize:
+                evicted.append(self._data.popitem(last=False)[0])
+                self.evictions += 1
+        if self.on_evict is not None:
+            for old in evicted:
+                self.on_evict(old)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class DBMBackend(object):
+    """ 保存在本地dbm文件中的缓存，进程重启后仍然有效
+    提交时的自动失效只对当前进程记录过的key有效，最好同时设置ttl
+        path: dbm文件的路径
+    """
+    # 不会主动淘汰，只是和:class:`LRUBackend`保持一致
+    on_evict = None
+
+    def __init__(self, path):
+        self.path = path
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._db = dbm.open(path, "c")
+
+    def _key(self, key):
+        return hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                data = self._db[self._key(key)]
+            except KeyError:
+                return None
+        return pickle.loads(data)
+
+    def set(self, key, value, expires):
+        data = pickle.dumps((value, expires), pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._db[self._key(key)] = data
+
+    def delete(self, key):
+        with self._lock:
+            try:
+                del self._db[self._key(key)]
+            except KeyError:
+                pass
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._db.keys()):
+                del self._db[key]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class QueryCache(object):
+    """ 一个缓存区域，结果序列化之后保存在backend中
+    session提交了对某张表的修改后，自动删除涉及这张表的缓存；
+    查询执行期间表的缓存被删除过时，查询结果可能已经过时，不写入缓存
+        backend: 默认为:class:`LRUBackend`
+        ttl: 默认的有效秒数，None表示不过期
+    """
+    # 每写入多少次清理一次索引中过期的key
+    sweep_interval = 256
+
+    def __init__(self, backend=None, ttl=None):
+        self.backend = backend if backend is not None else LRUBackend()
+        self.backend.on_evict = self._forget
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        # 表名 -> 涉及这张表的key，key -> (表名, 过期时间)
+        self._tables = {}
+        self._keys = {}
+        # 每张表被删除缓存的次数，以及`clear()`的次数，见:meth:`stamp`
+        self._generations = {}
+        self._cleared = 0
+        self._sets = 0
+        # backend淘汰key时在`set`中回调`_forget`，需要可重入
+        self._lock = threading.RLock()
+
+    def get(self, key):
+        """ 返回缓存的结果，不存在或者过期时返回None """
+        item = self.backend.get(key)
+        if item is not None:
+            data, expires = item
+            if expires is None or expires > time.time():
+                self.hits += 1
+                return pickle.loads(data)
+            self.backend.delete(key)
+        self._forget(key)
+        self.misses += 1
+        return None
+
+    def stamp(self, tables):
+        """ 执行查询之前调用，返回的值传给:meth:`set` """
+        with self._lock:
+            return self._stamp(tables)
+
+    def _stamp(self, tables):
+        generations = self._generations
+        return (self._cleared,) + tuple(generations.get(table, 0)
+                                        for table in sorted(tables))
+
+    def set(self, key, result, tables, ttl=None, stamp=None):
+        """
+        :stamp: 查询之前:meth:`stamp`的返回值，查询期间这些表的缓存被删除过时
+                不写入
+        """
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.time() + ttl if ttl is not None else None
+        data = pickle.dumps(result, pickle.HIGHEST_PROTOCOL)
+        # 先写索引，backend淘汰这个key时才能从索引中删除；
+        # 写入backend也持有锁，检查stamp之后不会再有失效插进来
+        with self._lock:
+            if stamp is not None and self._stamp(tables) != stamp:
+                return
+            self._unindex(key)
+            self._keys[key] = (tuple(tables), expires)
+            for table in tables:
+                self._tables.setdefault(table, set()).add(key)
+            self._sets += 1
+            sweep = self._sets % self.sweep_interval == 0
+            self.backend.set(key, data, expires)
+        if sweep:
+            self._sweep()
+
+    def _unindex(self, key):
+        """ 从索引中删除key，需要持有`_lock` """
+        tables, _ = self._keys.pop(key, ((), None))
+        for table in tables:
+            keys = self._tables.get(table)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tables[table]
+
+    def _forget(self, key):
+        with self._lock:
+            self._unindex(key)
+
+    def _sweep(self):
+        """ 删除已经过期但是没有再被读取的key """
+        now = time.time()
+        with self._lock:
+            expired = [key for key, (_, expires) in self._keys.items()
+                       if expires is not None and expires <= now]
+            for key in expired:
+                self._unindex(key)
+        for key in expired:
+            self.backend.delete(key)
+
+    def invalidate_tables(self, tables):
+        """ 删除涉及这些表的缓存，包含`ALL_TABLES`时删除全部缓存 """
+        if ALL_TABLES in tables:
+            with self._lock:
+                count = len(self._keys)
+            self.clear()
+            self.invalidations += count
+            return
+        keys = set()
+        with self._lock:
+            for table in tables:
+                self._generations[table] = self._generations.get(table, 0) + 1
+                keys.update(self._tables.get(table, ()))
+            for key in keys:
+                self._unindex(key)
+        for key in keys:
+            self.backend.delete(key)
+        self.invalidations += len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._tables.clear()
+            self._keys.clear()
+            self._cleared += 1
+        self.backend.clear()
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.backend.evictions,
+            "invalidations": self.invalidations,
+        }
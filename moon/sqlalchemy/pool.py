@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+""" 通过pool事件收集连接池的使用情况 """
+import time
+import threading
+from functools import wraps
+from sqlalchemy import event
+
+
+__all__ = ["PoolStats"]
+
+
+class PoolStats(object):
+    """ 连接池统计
+        checked_out: 当前借出的连接数
+        wait: 获取连接的等待时间(包括建立新连接)
+        hold: 连接从借出到归还的时间
+        lifetime: 连接从建立到关闭的时间
+    `engine.dispose()`会重建连接池，pool事件会转移到新的连接池上，
+    等待时间的统计在`engine_disposed`事件中重新安装
+    """
+    def __init__(self, engine):
+        self.engine = engine
+        self._lock = threading.Lock()
+        self.reset()
+        self._install(engine.pool)
+
+        @event.listens_for(engine, "engine_disposed")
+        def on_disposed(engine):
+            self._install_wait(engine.pool)
+
+    def reset(self):
+        with self._lock:
+            self.checked_out = 0
+            self.peak_checked_out = 0
+            self.peak_overflow = 0
+            self.checkouts = 0
+            self.connects = 0
+            self.closes = 0
+            self.invalidates = 0
+            self.wait = _Timing()
+            self.hold = _Timing()
+            self.lifetime = _Timing()
+
+    def _install_wait(self, pool):
+        """ pool没有获取连接之前的事件，只能包装`_do_get`来计时 """
+        _do_get = pool._do_get
+
+        @wraps(_do_get)
+        def timed_get():
+            start = time.time()
+            try:
+                return _do_get()
+            finally:
+                with self._lock:
+                    self.wait.add(time.time() - start)
+        pool._do_get = timed_get
+
+    def _install(self, pool):
+        self._install_wait(pool)
+
+        @event.listens_for(pool, "connect")
+        def on_connect(dbapi_conn, record):
+            record.info["moon_connect_time"] = time.time()
+            with self._lock:
+                self.connects += 1
+
+        @event.listens_for(pool, "checkout")
+        def on_checkout(dbapi_conn, record, proxy):
+            record.info["moon_checkout_time"] = time.time()
+            with self._lock:
+                self.checkouts += 1
+                self.checked_out += 1
+                if self.checked_out > self.peak_checked_out:
+                    self.peak_checked_out = self.checked_out
+                overflow = _pool_value(self.engine.pool, "overflow")
+                if overflow is not None:
+                    self.peak_overflow = max(self.peak_overflow, overflow)
+
+        @event.listens_for(pool, "checkin")
+        def on_checkin(dbapi_conn, record):
+            start = record.info.pop("moon_checkout_time", None)
+            if start is None:
+                return
+            with self._lock:
+                self.checked_out -= 1
+                self.hold.add(time.time() - start)
+
+        @event.listens_for(pool, "invalidate")
+        def on_invalidate(dbapi_conn, record, exception):
+            with self._lock:
+                self.invalidates += 1
+
+        @event.listens_for(pool, "close")
+        def on_close(dbapi_conn, record):
+            start = record.info.pop("moon_connect_time", None)
+            with self._lock:
+                self.closes += 1
+                if start is not None:
+                    self.lifetime.add(time.time() - start)
+
+    def snapshot(self):
+        """ 返回当前统计数据的dict """
+        pool = self.engine.pool
+        with self._lock:
+            data = {
+                "pool": pool.__class__.__name__,
+                "checked_out": self.checked_out,
+                "peak_checked_out": self.peak_checked_out,
+                "peak_overflow": self.peak_overflow,
+                "checkouts": self.checkouts,
+                "connects": self.connects,
+                "closes": self.closes,
+                "invalidates": self.invalidates,
+                "wait": self.wait.to_dict(),
+                "hold": self.hold.to_dict(),
+                "lifetime": self.lifetime.to_dict(),
+            }
+        for key in ("size", "overflow", "checkedin"):
+            value = _pool_value(pool, key)
+            if value is not None:
+                data["pool_" + key] = value
+        return data
+
+
+def _pool_value(pool, key):
+    """ QueuePool的size等是方法，SingletonThreadPool的size是属性 """
+    value = getattr(pool, key, None)
+    if callable(value):
+        value = value()
+    return value
+
+
+class _Timing(object):
+    """ 耗时的计数/总和/最大值 """
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def to_dict(self):
+        avg = self.total / self.count if self.count else 0.0
+        return {"count": self.count, "total": self.total,
+                "avg": avg, "max": self.max}
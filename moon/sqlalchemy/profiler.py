@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+""" 记录执行的SQL，统计耗时，发现慢查询和N+1查询 """
+import sys
+import json
+import time
+import logging
+import threading
+from collections import deque
+from sqlalchemy import event
+
+
+__all__ = ["QueryProfiler"]
+
+# 耗时直方图的上限(秒)，最后一个桶是超过最大值的
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+
+_SKIP_MODULES = ("sqlalchemy", "moon.sqlalchemy")
+
+
+def call_site():
+    """ 调用栈中第一个不在sqlalchemy里的位置 """
+    frame = sys._getframe(1)
+    while frame is not None:
+        # sqlalchemy动态生成的函数没有`__name__`
+        name = frame.f_globals.get("__name__")
+        if name and not name.startswith(_SKIP_MODULES):
+            code = frame.f_code
+            return "%s:%d in %s" % (code.co_filename, frame.f_lineno,
+                                    code.co_name)
+        frame = frame.f_back
+    return ""
+
+
+class _StatementStats(object):
+    """ 一条语句的次数、耗时和直方图 """
+    __slots__ = ("count", "total", "max", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+    def add(self, elapsed):
+        self.count += 1
+        self.total += elapsed
+        if elapsed > self.max:
+            self.max = elapsed
+        for i, limit in enumerate(BUCKETS):
+            if elapsed <= limit:
+                self.buckets[i] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+
+
+class QueryProfiler(object):
+    """ 通过engine事件统计执行的SQL
+        slow_threshold: 超过这个秒数的语句记为慢查询
+        n_plus_one: 一个事务(一次连接借出)中同一条语句执行超过这个次数记为N+1
+        keep: 最多保留多少条慢查询和N+1记录
+        logger: 发现慢查询和N+1时写日志
+    """
+    def __init__(self, slow_threshold=0.5, n_plus_one=10, keep=500,
+                 logger=None):
+        self.slow_threshold = slow_threshold
+        self.n_plus_one = n_plus_one
+        self.logger = logger or logging.getLogger("moon.sqlalchemy.profiler")
+        self.slow_queries = deque(maxlen=keep)
+        self.n_plus_one_queries = deque(maxlen=keep)
+        self._statements = {}
+        self._lock = threading.Lock()
+        self._engines = []
+
+    def install(self, engine):
+        event.listen(engine, "before_cursor_execute", self._before_execute)
+        event.listen(engine, "after_cursor_execute", self._after_execute)
+        event.listen(engine.pool, "checkin", self._checkin)
+        self._engines.append(engine)
+
+    def remove(self):
+        """ 停止统计 """
+        for engine in self._engines:
+            event.remove(engine, "before_cursor_execute",
+                         self._before_execute)
+            event.remove(engine, "after_cursor_execute", self._after_execute)
+            event.remove(engine.pool, "checkin", self._checkin)
+        self._engines = []
+
+    def reset(self):
+        with self._lock:
+            self._statements.clear()
+            self.slow_queries.clear()
+            self.n_plus_one_queries.clear()
+
+    def _before_execute(self, conn, cursor, statement, parameters, context,
+                        executemany):
+        conn.info.setdefault("moon_profile_start", []).append(time.time())
+
+    def _after_execute(self, conn, cursor, statement, parameters, context,
+                       executemany):
+        elapsed = time.time() - conn.info["moon_profile_start"].pop()
+        with self._lock:
+            stats = self._statements.get(statement)
+            if stats is None:
+                stats = self._statements[statement] = _StatementStats()
+            stats.add(elapsed)
+
+        if elapsed >= self.slow_threshold:
+            site = call_site()
+            self.slow_queries.append({
+                "statement": statement,
+                "elapsed": elapsed,
+                "call_site": site,
+                "time": time.time(),
+            })
+            self.logger.warning("slow query %.3fs at %s: %s",
+                                elapsed, site, statement)
+
+        counts = conn.info.setdefault("moon_profile_counts", {})
+        count = counts.get(statement, 0) + 1
+        counts[statement] = count
+        if count == self.n_plus_one:
+            # 第一次达到阈值时记录调用位置
+            conn.info.setdefault("moon_profile_sites", {})[statement] = \
+                call_site()
+
+    def _checkin(self, dbapi_conn, record):
+        counts = record.info.pop("moon_profile_counts", None)
+        sites = record.info.pop("moon_profile_sites", None)
+        record.info.pop("moon_profile_start", None)
+        if not sites:
+            return
+        for statement, site in sites.items():
+            self.n_plus_one_queries.append({
+                "statement": statement,
+                "count": counts[statement],
+                "call_site": site,
+                "time": time.time(),
+            })
+            self.logger.warning("possible N+1 query, executed %d times "
+                                "at %s: %s", counts[statement], site,
+                                statement)
+
+    def statements(self):
+        """ 每条语句的统计，按总耗时倒序 """
+        with self._lock:
+            items = [(s, st.count, st.total, st.max, list(st.buckets))
+                     for s, st in self._statements.items()]
+        result = [{
+            "statement": s,
+            "count": count,
+            "total": total,
+            "avg": total / count,
+            "max": max_,
+            "histogram": dict(zip([str(b) for b in BUCKETS] + ["inf"],
+                                  buckets)),
+        } for s, count, total, max_, buckets in items]
+        result.sort(key=lambda d: d["total"], reverse=True)
+        return result
+
+    def report(self):
+        return {
+            "statements": self.statements(),
+            "slow_queries": list(self.slow_queries),
+            "n_plus_one": list(self.n_plus_one_queries),
+        }
+
+    def dump(self, filename):
+        """ 把统计结果写入JSON文件 """
+        with open(filename, "w") as f:
+            json.dump(self.report(), f, indent=2)
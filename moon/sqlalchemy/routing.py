@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+""" 读写分离，只读的查询分配到从库 """
+import re
+import threading
+from itertools import cycle
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import DDLElement
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.sql.expression import Select, CompoundSelect, TextClause
+
+
+__all__ = ["ReplicaRouter", "RoutingSession", "WRITTEN_TABLES", "ALL_TABLES",
+           "BIND_OPTION"]
+
+# session在写入之后的读取也使用主库，直到`close()`，
+# 这样提交之后刷新对象不会因为从库的延迟读到旧数据
+_STICKY = "moon_routing_sticky"
+# 当前事务中修改过的表名，保存在`session.info`中
+# 语句的execution_options中也可以用这个key声明语句修改的表
+WRITTEN_TABLES = "moon_written_tables"
+# 无法判断修改了哪些表时，当作修改了所有的表
+ALL_TABLES = "*"
+# 语句的execution_options中指定使用的数据库，见:method:`BaseQuery.using`
+BIND_OPTION = "moon_bind"
+
+
+class ReplicaRouter(object):
+    """ 管理主库和从库的engine
+        replicas: 从库的`{名字: engine}`
+        policy: 选择从库的方式，"round_robin"或者"least_busy"(借出连接最少)
+    """
+    def __init__(self, primary, replicas, policy="round_robin"):
+        if policy not in ("round_robin", "least_busy"):
+            raise ValueError("unknown replica policy: %s" % policy)
+        self.primary = primary
+        self.replicas = replicas
+        self.policy = policy
+        self._names = sorted(replicas)
+        self._cycle = cycle(self._names)
+        self._lock = threading.Lock()
+
+    def pick(self):
+        """ 选择一个从库 """
+        if self.policy == "least_busy":
+            return min((self.replicas[n] for n in self._names),
+                       key=_checked_out)
+        with self._lock:
+            name = next(self._cycle)
+        return self.replicas[name]
+
+    def get(self, name):
+        """ "primary"为主库，"replica"按照policy选择从库，其他为从库的名字 """
+        if name == "primary":
+            return self.primary
+        if name == "replica":
+            return self.pick() if self.replicas else self.primary
+        return self.replicas[name]
+
+
+# 只读的文本语句
+_READONLY = re.compile(r"\s*(SELECT|SHOW|EXPLAIN|PRAGMA|DESCRIBE|VALUES)\b",
+                       re.I)
+
+
+def _written_tables(clause, options):
+    """ 语句修改的表名，只读语句返回空tuple """
+    declared = options.get(WRITTEN_TABLES)
+    if declared:
+        return tuple(declared)
+    if isinstance(clause, UpdateBase):
+        return (clause.table.name,)
+    if isinstance(clause, TextClause):
+        return () if _READONLY.match(clause.text) else (ALL_TABLES,)
+    if isinstance(clause, DDLElement):
+        return (ALL_TABLES,)
+    return ()
+
+
+def _checked_out(engine):
+    checkedout = getattr(engine.pool, "checkedout", None)
+    return checkedout() if checkedout else 0
+
+
+class RoutingSession(Session):
+    """ 根据语句选择主库或者从库
+    SELECT分配到从库；flush、写语句、SELECT ... FOR UPDATE和写入之后的查询使用主库
+    语句的execution_options中有`BIND_OPTION`时使用指定的数据库
+    """
+    def __init__(self, router=None, **kwargs):
+        super(RoutingSession, self).__init__(**kwargs)
+        self.router = router
+        # 注册在实例上：SQLAlchemy 1.3中sessionmaker上有同名事件时，
+        # 注册在类上的监听不会被调用；实例上的监听在其他监听之后调用，
+        # 缓存失效等其他after_transaction_end监听还能读到WRITTEN_TABLES
+        event.listen(self, "after_flush", _record_flushed_tables)
+        event.listen(self, "after_transaction_end", _clear_written_tables)
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        # SQLAlchemy 1.3通过`Session.connection`的额外参数传入，
+        # 1.4在语句的execution_options中
+        options = getattr(clause, "get_execution_options", None)
+        options = options() if options is not None else {}
+        name = kw.pop(BIND_OPTION, None) or options.get(BIND_OPTION)
+        tables = _written_tables(clause, options)
+        if tables:
+            self.info.setdefault(WRITTEN_TABLES, set()).update(tables)
+        router = self.router
+        if router is None or kw.get("bind") is not None:
+            return super(RoutingSession, self).get_bind(mapper, clause, **kw)
+        if name is not None:
+            return router.get(name)
+        if not router.replicas:
+            return super(RoutingSession, self).get_bind(mapper, clause, **kw)
+        if self._flushing:
+            self.info[_STICKY] = True
+            return router.primary
+        if isinstance(clause, (Select, CompoundSelect)) and \
+           getattr(clause, "_for_update_arg", None) is None:
+            if self.info.get(_STICKY):
+                return router.primary
+            return router.pick()
+        if tables:
+            self.info[_STICKY] = True
+        return router.primary
+
+    def close(self):
+        super(RoutingSession, self).close()
+        self.info.pop(_STICKY, None)
+
+
+def _clear_written_tables(session, transaction):
+    """ 最外层的事务结束时清除，包括`with session.begin()`和`close()` """
+    if transaction.parent is None:
+        session.info.pop(WRITTEN_TABLES, None)
+
+
+def _record_flushed_tables(session, flush_context):
+    """ after_flush中session.new/dirty/deleted仍然是flush之前的状态 """
+    tables = session.info.setdefault(WRITTEN_TABLES, set())
+    for objs in (session.new, session.dirty, session.deleted):
+        for obj in objs:
+            for table in obj.__mapper__.tables:
+                tables.add(table.name)
@@ -1,7 +1,19 @@
 # -*- coding: utf-8 -*-
-__all__ = ["cached_property"]
+import time
+import inspect
+import weakref
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+__all__ = ["cached_property", "locked_cached_property", "ttl_cached_property",
+           "slot_cached_property", "invalidate_cached_properties", "memoize"]
 
 _missing = object()
+_kwmark = object()
+# python2中没有monotonic
+_clock = getattr(time, "monotonic", time.time)
+_getargspec = getattr(inspect, "getfullargspec", None) or inspect.getargspec
 
 
 # Copy From werkzeug.utils
@@ -44,3 +56,313 @@ class cached_property(object):
             value = self.func(obj)
             obj.__dict__[self.__name__] = value
         return value
+
+    def _clear(self, obj):
+        obj.__dict__.pop(self.__name__, None)
+
+
+# 不能弱引用或者不能hash的实例使用的一组锁，按id分配
+_lock_stripes = [threading.RLock() for _ in range(32)]
+
+
+class locked_cached_property(cached_property):
+    """和:class:`cached_property`相同，但是用锁保证多线程下每个实例只计算一次，
+    计算完成之后的访问不需要加锁，不同实例的计算不会互相等待。
+    锁保存在descriptor上，不会出现在实例的`__dict__`中，不影响pickle和copy
+    """
+
+    def __init__(self, func, name=None, doc=None):
+        super(locked_cached_property, self).__init__(func, name, doc)
+        # 实例 -> 锁，实例回收后自动删除
+        self._locks = weakref.WeakKeyDictionary()
+        self._locks_guard = threading.Lock()
+
+    def _lock(self, obj):
+        try:
+            with self._locks_guard:
+                lock = self._locks.get(obj)
+                if lock is None:
+                    lock = self._locks[obj] = threading.RLock()
+                return lock
+        except TypeError:
+            return _lock_stripes[id(obj) % len(_lock_stripes)]
+
+    def __get__(self, obj, type=None):
+        if obj is None:
+            return self
+        value = obj.__dict__.get(self.__name__, _missing)
+        if value is not _missing:
+            return value
+        with self._lock(obj):
+            value = obj.__dict__.get(self.__name__, _missing)
+            if value is _missing:
+                value = self.func(obj)
+                obj.__dict__[self.__name__] = value
+            return value
+
+
+class ttl_cached_property(cached_property):
+    """缓存`ttl`秒之后重新计算的lazy property::
+
+        class Foo(object):
+
+            @ttl_cached_property(60)
+            def foo(self):
+                return load_config()
+    """
+
+    def __init__(self, ttl, name=None, doc=None):
+        self.ttl = ttl
+        self._name = name
+        self._doc = doc
+
+    def __call__(self, func):
+        super(ttl_cached_property, self).__init__(func, self._name, self._doc)
+        # 值和过期时间存在另外的key中，每次访问都会经过__get__
+        self._key = "_ttl_cached_%s" % self.__name__
+        return self
+
+    def __get__(self, obj, type=None):
+        if obj is None:
+            return self
+        now = _clock()
+        cached = obj.__dict__.get(self._key)
+        if cached is None or cached[1] <= now:
+            cached = (self.func(obj), now + self.ttl)
+            obj.__dict__[self._key] = cached
+        return cached[0]
+
+    def _clear(self, obj):
+        obj.__dict__.pop(self._key, None)
+
+
+class slot_cached_property(cached_property):
+    """用于定义了`__slots__`的类，结果保存在指定的slot中::
+
+        class Foo(object):
+            __slots__ = ("_foo", )
+
+            @slot_cached_property("_foo")
+            def foo(self):
+                return 42
+    """
+
+    def __init__(self, slot, name=None, doc=None):
+        self.slot = slot
+        self._name = name
+        self._doc = doc
+
+    def __call__(self, func):
+        super(slot_cached_property, self).__init__(func, self._name, self._doc)
+        return self
+
+    def __get__(self, obj, type=None):
+        if obj is None:
+            return self
+        try:
+            return getattr(obj, self.slot)
+        except AttributeError:
+            value = self.func(obj)
+            setattr(obj, self.slot, value)
+            return value
+
+    def _clear(self, obj):
+        try:
+            delattr(obj, self.slot)
+        except AttributeError:
+            pass
+
+
+def invalidate_cached_properties(obj, *names):
+    """ 清除实例上缓存的property，下次访问时重新计算，不指定names时清除全部 """
+    seen = set()
+    for klass in type(obj).__mro__:
+        for name, attr in vars(klass).items():
+            if name in seen or not isinstance(attr, cached_property):
+                continue
+            seen.add(name)
+            if not names or name in names:
+                attr._clear(obj)
+
+
+class _Call(object):
+    """ 正在计算中的调用，其它线程等待它完成 """
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = _missing
+
+
+class MemoCache(object):
+    """ :func:`memoize`使用的缓存，LRU淘汰，可选的过期时间，线程安全 """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self._data = OrderedDict()
+        self._calls = {}
+        self.hits = self.misses = self.evictions = self.expired = 0
+
+    def _get(self, key):
+        item = self._data.pop(key, None)
+        if item is None:
+            return _missing
+        if item[1] is not None and item[1] <= _clock():
+            self.expired += 1
+            return _missing
+        # 重新插入，移到最近使用的一端
+        self._data[key] = item
+        return item[0]
+
+    def get(self, key):
+        with self.lock:
+            value = self._get(key)
+            if value is _missing:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return value
+
+    def shared(self):
+        """ 等到了其它调用的计算结果，也算作命中 """
+        with self.lock:
+            self.hits += 1
+
+    def set(self, key, value):
+        expires = _clock() + self.ttl if self.ttl is not None else None
+        with self.lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, expires)
+            if self.maxsize is not None:
+                while len(self._data) > self.maxsize:
+                    self._data.popitem(last=False)
+                    self.evictions += 1
+
+    def delete(self, key):
+        with self.lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self._data.clear()
+
+    def claim(self, key):
+        """ 返回(缓存的值, None)，没有缓存时返回(_missing, (call, 是否由自己计算)) """
+        with self.lock:
+            value = self._get(key)
+            if value is not _missing:
+                self.hits += 1
+                return value, None
+            call = self._calls.get(key)
+            if call is not None:
+                return _missing, (call, False)
+            self.misses += 1
+            call = self._calls[key] = _Call()
+            return _missing, (call, True)
+
+    def release(self, key, call, value=_missing):
+        if value is not _missing:
+            self.set(key, value)
+        with self.lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+        call.value = value
+        call.event.set()
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expired": self.expired,
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+        }
+
+
+def _default_key(args, kwargs):
+    if not kwargs:
+        return args
+    return args + (_kwmark, ) + tuple(sorted(kwargs.items()))
+
+
+def _key_maker(func, key, keys):
+    """ key: 接受和函数相同参数的callable
+        keys: {参数名: callable}，参数先经过转换再作为key的一部分
+    """
+    if key is not None:
+        return lambda args, kwargs: key(*args, **kwargs)
+    if not keys:
+        return _default_key
+    try:
+        argnames = _getargspec(func).args
+    except TypeError:
+        argnames = []
+    converters = [(argnames.index(name) if name in argnames else None,
+                   name, convert) for name, convert in keys.items()]
+
+    def makekey(args, kwargs):
+        args, kwargs = list(args), dict(kwargs)
+        for pos, name, convert in converters:
+            if name in kwargs:
+                kwargs[name] = convert(kwargs[name])
+            elif pos is not None and pos < len(args):
+                args[pos] = convert(args[pos])
+        return _default_key(tuple(args), kwargs)
+    return makekey
+
+
+def memoize(func=None, maxsize=1024, ttl=None, key=None, keys=None):
+    """ 缓存函数的返回值::
+
+        @memoize(maxsize=100, ttl=60, keys={"user": lambda u: u.id})
+        def permissions(user, scope=None):
+            ...
+
+        maxsize: 最多缓存多少个结果，超出后淘汰最久没有使用的，None表示不限
+        ttl: 结果缓存的秒数，None表示不过期
+        key: 计算缓存key的函数，接受和被装饰函数相同的参数
+        keys: 按参数名指定转换函数，转换后的值作为key的一部分
+    同一个key同时只会计算一次，其它调用等待计算结果，抛出异常时不缓存。
+    可以装饰`async def`函数(需要python3)。
+    装饰后的函数有`cache`, `stats()`, `clear()`和`invalidate(*args, **kwargs)`
+    """
+    if func is None:
+        return lambda func: memoize(func, maxsize, ttl, key, keys)
+
+    cache = MemoCache(maxsize, ttl)
+    makekey = _key_maker(func, key, keys)
+    check = getattr(inspect, "iscoroutinefunction", None)
+    if check is not None and check(func):
+        from .aio import memoize_coroutine
+        decoed = memoize_coroutine(cache, func, makekey)
+    else:
+        @wraps(func)
+        def decoed(*args, **kwargs):
+            k = makekey(args, kwargs)
+            while True:
+                value, claimed = cache.claim(k)
+                if claimed is None:
+                    return value
+                call, owner = claimed
+                if owner:
+                    break
+                call.event.wait()
+                # 计算出错时重新尝试
+                if call.value is not _missing:
+                    cache.shared()
+                    return call.value
+
+            value = _missing
+            try:
+                value = func(*args, **kwargs)
+                return value
+            finally:
+                cache.release(k, call, value)
+
+    decoed.cache = cache
+    decoed.stats = cache.stats
+    decoed.clear = cache.clear
+    decoed.invalidate = lambda *args, **kwargs: cache.delete(
+        makekey(args, kwargs))
+    return decoed
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 import re
+import inspect
 from werkzeug.datastructures import MultiDict
 from werkzeug.exceptions import BadRequest
 import six
@@ -17,6 +18,42 @@ class NameSpace(dict):
         self[name] = value
 
 
+try:
+    _getargspec = inspect.getfullargspec
+except AttributeError:
+    _getargspec = inspect.getargspec
+
+# 多传参数一定抛出TypeError的常用类型，可以直接用一个参数调用
+_SIMPLE_TYPES = frozenset(six.integer_types + (float, bool) +
+                          ((str,) if six.PY2 else ()))
+# 第二个参数是编码，只有value已经是这个类型时才可以直接调用，
+# 否则`unicode(value, name)`会抛出"unknown encoding"
+_STRING_TYPES = frozenset((six.text_type, six.binary_type)) - _SIMPLE_TYPES
+
+
+def _type_arity(func):
+    """ 类型函数接受几个参数(value, name, op)，无法判断时返回None """
+    if func in _SIMPLE_TYPES:
+        return 1
+    if inspect.isclass(func):
+        return None
+    target = func
+    if not (inspect.isfunction(target) or inspect.ismethod(target)):
+        target = getattr(func, "__call__", None)
+        if not (inspect.isfunction(target) or inspect.ismethod(target)):
+            return None
+    try:
+        spec = _getargspec(target)
+    except TypeError:
+        return None
+    if spec.varargs:
+        return 3
+    nargs = len(spec.args)
+    if inspect.ismethod(target) and target.__self__ is not None:
+        nargs -= 1
+    return min(nargs, 3) or None
+
+
 class ArgumentError(ValueError):
     def __init__(self, arg, msg):
         super(ArgumentError, self).__init__(msg)
@@ -45,17 +82,30 @@ class Argument(object):
         self.min_len = min_len
         self.max_count = max_count
         self.min_count = min_count
+        self.compile()
 
-    def source(self, request):
+    def compile(self):
+        """ 预先计算解析时需要的数据，修改属性之后需要重新调用 """
+        self._names = tuple((op, self.name + op.replace("=", "", 1))
+                            for op in self.operators)
         if isinstance(self.location, six.string_types):
-            value = getattr(request, self.location, MultiDict())
+            self._locations = (self.location,)
+        else:
+            self._locations = tuple(self.location)
+        try:
+            self._choices = frozenset(self.choices)
+        except TypeError:
+            self._choices = self.choices
+        self._arity = _type_arity(self.type)
+        self._required_msg = u"{0} is required in {1}".format(
+            self.name, " or ".join(self._locations))
+        return self
+
+    def source(self, request):
+        for l in self._locations:
+            value = getattr(request, l, None)
             if value is not None:
                 return value
-        else:
-            for l in self.location:
-                value = getattr(request, l, None)
-                if value is not None:
-                    return value
         return MultiDict()
 
     def convert(self, value, op):
@@ -64,13 +114,21 @@ class Argument(object):
                 "value length {0} out of limit -- max:{1} min:{2}"
                 .format(len(value), self.max_len, self.min_len)
             )
-        try:
-            return self.type(value, self.name, op)
-        except TypeError:
+        arity = self._arity
+        if arity == 1 or (self.type in _STRING_TYPES and
+                          isinstance(value, self.type)):
+            return self.type(value)
+        # 依次尝试(value, name, op)、(value, name)、(value)，
+        # 只跳过参数个数一定不对的调用，类型函数内部的TypeError同样会重试
+        if arity is None or arity == 3:
             try:
-                return self.type(value, self.name)
+                return self.type(value, self.name, op)
             except TypeError:
-                return self.type(value)
+                pass
+        try:
+            return self.type(value, self.name)
+        except TypeError:
+            return self.type(value)
 
     def handle_validation_error(self, error):
         msg = self.help if self.help is not None else unicode(error)
@@ -81,8 +139,7 @@ class Argument(object):
 
         results = []
 
-        for operator in self.operators:
-            name = self.name + operator.replace("=", "", 1)
+        for operator, name in self._names:
             if name in source:
                 if hasattr(source, "getlist"):
                     values = source.getlist(name)
@@ -92,7 +149,7 @@ class Argument(object):
                 for value in values:
                     if not self.case_sensitive:
                         value = value.lower()
-                    if self.choices and value not in self.choices:
+                    if self._choices and value not in self._choices:
                         self.handle_validation_error(
                             ValueError(
                                 u'{0} is not valid choice'.format(value))
@@ -107,17 +164,7 @@ class Argument(object):
                     results.append(value)
 
         if not results and self.required:
-            if isinstance(self.location, six.string_types):
-                error_msg = u"{0} is required in {1}".format(
-                    self.name,
-                    self.location
-                )
-            else:
-                error_msg = u"{0} is required in {1}".format(
-                    self.name,
-                    " or ".join(self.location)
-                )
-            self.handle_validation_error(ValueError(error_msg))
+            self.handle_validation_error(ValueError(self._required_msg))
 
         if not results:
             return self.default
@@ -144,21 +191,33 @@ class RequestParser(object):
         self.args = []
         self.argument_class = argument_class
         self.namespace_class = namespace_class
+        self._plan = None
 
     def add_argument(self, *args, **kwargs):
         self.args.append(self.argument_class(*args, **kwargs))
+        self._plan = None
+        return self
+
+    def compile(self):
+        """ 预先计算每个参数的解析数据，第一次`parse_args`时会自动调用，
+        修改了参数的属性之后需要重新调用
+        """
+        self._plan = tuple((arg.compile(), arg.dest or arg.name)
+                           for arg in self.args)
         return self
 
     def parse_args(self, req, clear_none=False):
+        if self._plan is None:
+            self.compile()
         namespace = self.namespace_class()
 
-        for arg in self.args:
+        for arg, dest in self._plan:
             try:
                 value = arg.parse(req)
             except ArgumentError as e:
                 self.handle_argument_error(e)
             if (value is not None) or (not clear_none):
-                namespace[arg.dest or arg.name] = value
+                namespace[dest] = value
 
         return namespace
 
@@ -1,4 +1,27 @@
 # -*- coding: utf-8 -*-
-from test import funclogger
+import sys
+from test import funclogger, database, counts, streaming, \
+    bulk, archive, pool, routing, querycache, \
+    profiler, presets, funclimit, sysloghandler, \
+    jsonformatter, cachedproperty, memoize
 
 funclogger.main()
+database.main()
+counts.main()
+streaming.main()
+bulk.main()
+archive.main()
+pool.main()
+routing.main()
+querycache.main()
+profiler.main()
+presets.main()
+funclimit.main()
+sysloghandler.main()
+jsonformatter.main()
+cachedproperty.main()
+memoize.main()
+
+if sys.version_info >= (3, 7):
+    from test import aio
+    aio.main()
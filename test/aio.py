@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+""" asyncio版本的测试，需要Python 3.7+、SQLAlchemy 1.4+和aiosqlite """
+import os
+import shutil
+import asyncio
+import tempfile
+from sqlalchemy import select
+from moon.sqlalchemy import PageNotFound
+from moon.sqlalchemy.aio import AsyncSQLAlchemy
+from moon.utils import memoize
+
+
+db = AsyncSQLAlchemy()
+
+
+class Item(db.Model):
+    __tablename__ = "item"
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(20))
+
+
+async def test_paginate():
+    await db.drop_all()
+    await db.create_all()
+    db.session.add_all([Item(id=i, name="n%d" % i) for i in range(1, 24)])
+    await db.session.commit()
+
+    statement = select(Item).order_by(Item.id)
+    for concurrent in (True, False):
+        page = await db.paginate(statement, 2, 10, concurrent=concurrent)
+        assert [o.id for o in page.items] == list(range(11, 21))
+        assert (page.total, page.pages) == (23, 3)
+        last = await page.next()
+        assert [o.id for o in last.items] == [21, 22, 23]
+        assert (await last.prev()).page_num == 2
+
+    page = await db.paginate(select(Item.id, Item.name).order_by(Item.id),
+                             1, 2)
+    assert [tuple(r) for r in page.items] == [(1, "n1"), (2, "n2")]
+    try:
+        await db.paginate(statement, 9, 10, error_out=True)
+    except PageNotFound:
+        pass
+    else:
+        raise AssertionError("PageNotFound not raised")
+    assert db.pool_stats.snapshot()["checkouts"] > 0
+    await db.session.remove()
+
+
+async def test_task_sessions():
+    """ 每个task使用自己的session """
+    async def current():
+        session = db.session()
+        await db.session.remove()
+        return session
+    sessions = await asyncio.gather(current(), current())
+    assert sessions[0] is not sessions[1]
+
+
+async def test_memoize():
+    calls = []
+
+    @memoize(maxsize=10)
+    async def fetch(x):
+        calls.append(x)
+        await asyncio.sleep(0.05)
+        return x + 1
+
+    @memoize
+    async def fail(x):
+        calls.append("fail")
+        await asyncio.sleep(0.01)
+        raise KeyError(x)
+
+    # 同一个key同时只await一次
+    assert await asyncio.gather(*[fetch(1) for _ in range(10)]) == [2] * 10
+    assert calls == [1] and fetch.stats()["hits"] == 9
+    results = await asyncio.gather(*[fail(1) for _ in range(3)],
+                                   return_exceptions=True)
+    assert all(isinstance(r, KeyError) for r in results)
+    assert calls.count("fail") == 3
+
+
+def test_sync_only():
+    for name in ("bulk_insert", "enable_profiler", "cache_regions",
+                 "use_scoped_session", "dump_deleted"):
+        assert not hasattr(db, name), name
+    assert db.Model.query is None
+
+
+def main():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        db.use_async_session(sa_url="sqlite+aiosqlite:///" +
+                             os.path.join(tmpdir, "aio.db"))
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(test_paginate())
+            loop.run_until_complete(test_task_sessions())
+            loop.run_until_complete(test_memoize())
+            loop.run_until_complete(db._engine.dispose())
+        finally:
+            loop.close()
+        test_sync_only()
+    finally:
+        shutil.rmtree(tmpdir)
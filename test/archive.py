@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import shutil
+import logging
+import tempfile
+from moon.sqlalchemy import SQLAlchemy, DeletedArchiver
+
+
+class Records(logging.Handler):
+    """ 收集日志记录 """
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def archived(archiver):
+    archiver.flush()
+    if not os.path.exists(archiver.path):
+        return []
+    with open(archiver.path) as f:
+        return [json.loads(line)["data"]["id"] for line in f]
+
+
+def test_dump_deleted(tmpdir):
+    archiver = DeletedArchiver(os.path.join(tmpdir, "deleted"),
+                               interval=0.05)
+    adb = SQLAlchemy(dump_deleted=archiver)
+
+    class Doc(adb.Model):
+        __tablename__ = "doc"
+        _dump_deleted = True
+        id = adb.Column(adb.Integer, primary_key=True)
+
+    adb.use_scoped_session(sa_url="sqlite://")
+    adb.create_all()
+    adb.bulk_insert(Doc, [{"id": i} for i in range(1, 6)])
+    adb.session.commit()
+    session = adb.session
+
+    session.delete(Doc.query.get(1))
+    session.commit()
+    assert archived(archiver) == [1]
+
+    # 回滚的删除不会写入，包括close()中的回滚
+    session.delete(Doc.query.get(2))
+    session.flush()
+    session.rollback()
+    session.delete(Doc.query.get(3))
+    session.flush()
+    session.close()
+    session.add(Doc(id=10))
+    session.commit()
+    assert archived(archiver) == [1]
+
+    session.delete(Doc.query.get(2))
+    session.delete(Doc.query.get(3))
+    session.commit()
+    assert sorted(archived(archiver)) == [1, 2, 3]
+
+    # 写入出错时记录日志，后台线程继续运行
+    handler = Records()
+    logger = logging.getLogger("moon.sqlalchemy.archive")
+    logger.addHandler(handler)
+    logger.propagate = False
+    try:
+        archiver.directory = os.path.join(tmpdir, "file")
+        open(archiver.directory, "w").close()
+        session.delete(Doc.query.get(4))
+        session.commit()
+        archiver.flush()
+        assert len(handler.records) == 1
+    finally:
+        logger.removeHandler(handler)
+        logger.propagate = True
+    archiver.directory = os.path.join(tmpdir, "deleted")
+    session.delete(Doc.query.get(5))
+    session.commit()
+    assert sorted(archived(archiver)) == [1, 2, 3, 5]
+    archiver.close()
+    adb.session.remove()
+
+
+def test_rotate(tmpdir):
+    archiver = DeletedArchiver(tmpdir, max_bytes=1, compress=True,
+                               interval=0.05)
+    for i in range(3):
+        archiver.put([{"id": i}])
+        archiver.flush()
+    archiver.close()
+    assert len(os.listdir(tmpdir)) == 3
+
+
+def main():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        test_dump_deleted(tmpdir)
+        test_rotate(os.path.join(tmpdir, "rotate"))
+    finally:
+        shutil.rmtree(tmpdir)
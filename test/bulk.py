@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime
+from test.database import db, Item, setup, reset
+
+
+class Book(db.Model):
+    __tablename__ = "book"
+    _csupdate_keys = ("title",)
+    id = db.Column(db.Integer, primary_key=True)
+    title = db.Column(db.String(20))
+    isbn = db.Column(db.String(20))
+
+
+class Post(db.Model):
+    __tablename__ = "post"
+    _csupdate_keys = ("title",)
+    id = db.Column(db.Integer, primary_key=True)
+    title = db.Column(db.String(20))
+    update_time = db.Column(db.DateTime)
+
+
+def items():
+    rows = Item.query.with_entities(Item.id, Item.name, Item.rank) \
+        .order_by(Item.id).all()
+    return [tuple(r) for r in rows]
+
+
+def test_bulk_insert_update():
+    reset(3)
+    assert db.bulk_insert(Item, ({"id": i, "name": "x", "rank": 0}
+                                 for i in range(4, 9)), batch_size=2) == 5
+    assert db.bulk_update(Item, [{"id": 1, "name": "one"},
+                                 {"id": 2, "rank": 9},
+                                 {"id": 3, "name": "three"}]) == 3
+    db.session.commit()
+    assert items()[:3] == [(1, "one", 1), (2, "n2", 9), (3, "three", 3)]
+    assert len(items()) == 8
+
+
+def test_bulk_update_keys():
+    reset(0)
+    db.bulk_insert(Book, [{"id": 1, "title": "a", "isbn": "1"},
+                          {"id": 2, "title": "b", "isbn": "2"}])
+    # 只修改`_csupdate_keys`中的列，没有可以修改的列的行被忽略
+    assert db.bulk_update(Book, [{"id": 1, "isbn": "x"}]) == 0
+    assert db.bulk_update(Book, [{"id": 1, "title": "A", "isbn": "x"},
+                                 {"id": 2, "isbn": "y"}]) == 1
+    rows = db.session.query(Book.id, Book.title, Book.isbn) \
+        .order_by(Book.id).all()
+    assert [tuple(r) for r in rows] == [(1, "A", "1"), (2, "b", "2")]
+
+    # 有update_time时总会更新
+    db.bulk_insert(Post, [{"id": 1, "title": "p"}])
+    assert db.bulk_update(Post, [{"id": 1}]) == 1
+    assert isinstance(db.session.query(Post.update_time).scalar(), datetime)
+    db.session.rollback()
+
+
+def test_bulk_upsert():
+    reset(3)
+    assert db.bulk_upsert(Item, []) == 0
+    db.bulk_upsert(Item, [{"id": 3, "name": "three", "rank": 0},
+                          {"id": 4, "name": "four", "rank": 0}])
+    db.bulk_upsert(Item, [{"id": 1, "name": "one", "rank": 7}],
+                   update_keys=["name"])
+    db.session.commit()
+    assert items() == [(1, "one", 1), (2, "n2", 2), (3, "three", 0),
+                       (4, "four", 0)]
+
+
+def main():
+    setup()
+    test_bulk_insert_update()
+    test_bulk_update_keys()
+    test_bulk_upsert()
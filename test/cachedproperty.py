@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+import copy
+import time
+import pickle
+import threading
+from moon.utils import cached_property, locked_cached_property, \
+    ttl_cached_property, slot_cached_property, invalidate_cached_properties
+
+
+class Config(object):
+    def __init__(self):
+        self.calls = []
+
+    @locked_cached_property
+    def data(self):
+        self.calls.append("data")
+        time.sleep(0.05)
+        # 计算中访问同一个实例的另一个property不会死锁
+        return {"size": self.size}
+
+    @locked_cached_property
+    def size(self):
+        self.calls.append("size")
+        return 3
+
+    @cached_property
+    def plain(self):
+        return []
+
+    @ttl_cached_property(0.05)
+    def stamp(self):
+        self.calls.append("stamp")
+        return len(self.calls)
+
+
+class Unhashable(Config):
+    __hash__ = None
+
+
+class Slotted(object):
+    __slots__ = ("_value", "calls")
+
+    def __init__(self):
+        self.calls = 0
+
+    @slot_cached_property("_value")
+    def value(self):
+        self.calls += 1
+        return self.calls
+
+
+def access(objs, threads=8):
+    start = threading.Event()
+
+    def worker():
+        start.wait()
+        for obj in objs:
+            assert obj.data == {"size": 3}
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for t in workers:
+        t.start()
+    start.set()
+    for t in workers:
+        t.join()
+
+
+def test_locked():
+    objs = [Config(), Config(), Unhashable()]
+    access(objs)
+    for obj in objs:
+        assert obj.calls == ["data", "size"], obj.calls
+    # 不同实例的计算可以同时进行
+    objs = [Config() for _ in range(4)]
+    start = time.time()
+    workers = [threading.Thread(target=lambda o=o: o.data) for o in objs]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    assert time.time() - start < 0.15
+
+
+def test_copy():
+    obj = Config()
+    obj.data
+    # 实例中只有计算结果，可以pickle和copy
+    assert sorted(obj.__dict__) == ["calls", "data", "size"]
+    for clone in (pickle.loads(pickle.dumps(obj)), copy.deepcopy(obj)):
+        assert clone.data == {"size": 3} and clone.calls == ["data", "size"]
+        invalidate_cached_properties(clone, "data")
+        assert clone.data == {"size": 3}
+        assert clone.calls == ["data", "size", "data"]
+    assert obj.calls == ["data", "size"]
+
+
+def test_ttl_and_invalidate():
+    obj = Config()
+    assert obj.stamp == obj.stamp == 1
+    time.sleep(0.06)
+    assert obj.stamp == 2
+    plain = obj.plain
+    assert obj.plain is plain
+    obj.data
+    invalidate_cached_properties(obj)
+    assert obj.plain is not plain and obj.stamp == 5
+    assert obj.calls == ["stamp", "stamp", "data", "size", "stamp"]
+
+    slotted = Slotted()
+    assert slotted.value == slotted.value == 1
+    invalidate_cached_properties(slotted, "value")
+    assert slotted.value == 2
+
+
+def main():
+    test_locked()
+    test_copy()
+    test_ttl_and_invalidate()
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+from contextlib import contextmanager
+from sqlalchemy import event
+from moon.sqlalchemy import ExactCount, CachedCount, EstimatedCount, \
+    NoCount, WindowCount
+from test.database import db, Item, setup, reset
+
+
+@contextmanager
+def count_statements(result):
+    """ 把执行的语句记录在result中 """
+    def before(conn, cursor, statement, parameters, context, executemany):
+        result.append(statement)
+    engine = db.session.get_bind()
+    event.listen(engine, "before_cursor_execute", before)
+    try:
+        yield result
+    finally:
+        event.remove(engine, "before_cursor_execute", before)
+
+
+def test_exact_and_estimated():
+    reset()
+    query = Item.query.filter(Item.rank == 0).order_by(Item.id)
+    for count in (ExactCount(), EstimatedCount()):
+        page = query.paginate(1, 2, count=count)
+        assert (page.total, page.total_kind) == (4, "exact"), count
+        assert [o.id for o in page.items] == [5, 10]
+    # SQLite无法估算
+    assert EstimatedCount().estimate(query) is None
+    # 第一页不满时不需要再计算总数
+    page = query.paginate(1, 10, count=EstimatedCount())
+    assert (page.total, page.total_kind) == (4, "exact")
+
+
+def test_no_count():
+    reset()
+    query = Item.query.filter(Item.rank == 0).order_by(Item.id)
+    page = query.paginate(2, 3, count=NoCount())
+    assert page.total is None and page.pages is None
+    assert not page.has_next and [o.id for o in page.items] == [20]
+    page = query.paginate(1, 3, count=NoCount())
+    assert page.has_next and len(page.items) == 3
+    assert page.next().items[0].id == 20
+
+
+def test_cached_count():
+    reset()
+    query = Item.query.filter(Item.rank == 0).order_by(Item.id)
+    cached = CachedCount(ttl=60)
+    assert query.paginate(1, 2, count=cached).total_kind == "exact"
+    db.bulk_insert(Item, [{"id": 100, "name": "new", "rank": 0}])
+    page = query.paginate(1, 2, count=cached)
+    assert (page.total, page.total_kind) == (4, "cached")
+    # 不同的参数使用不同的缓存
+    other = Item.query.filter(Item.rank == 1).order_by(Item.id)
+    assert other.paginate(1, 2, count=cached).total_kind == "exact"
+    cached.clear()
+    assert query.paginate(1, 2, count=cached).total == 5
+
+    expiring = CachedCount(ttl=0)
+    query.paginate(1, 2, count=expiring)
+    assert query.paginate(1, 2, count=expiring).total_kind == "exact"
+    db.session.rollback()
+
+
+def test_window_count():
+    reset()
+    query = Item.query.filter(Item.rank == 0).order_by(Item.id)
+    with count_statements([]) as statements:
+        page = query.paginate(2, 2, count=WindowCount())
+    assert len(statements) == 1 and "OVER" in statements[0]
+    assert (page.total, page.total_kind) == (4, "exact")
+    assert [o.id for o in page.items] == [15, 20] and not page.has_next
+
+    rows = db.session.query(Item.id, Item.name).filter(Item.rank == 0) \
+        .order_by(Item.id).paginate(1, 2, count=WindowCount())
+    assert [tuple(r) for r in rows.items] == [(5, "n5"), (10, "n10")]
+    assert rows.total == 4
+    # 超出最后一页时单独计算总数
+    page = query.paginate(5, 2, count=WindowCount())
+    assert page.items == [] and page.total == 4
+    empty = Item.query.filter(Item.id < 0).paginate(1, 2, count=WindowCount())
+    assert (empty.items, empty.total) == ([], 0)
+
+
+def main():
+    setup()
+    test_exact_and_estimated()
+    test_no_count()
+    test_cached_count()
+    test_window_count()
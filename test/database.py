@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+""" moon.sqlalchemy的测试，使用SQLite，不需要额外的数据库 """
+from moon.sqlalchemy import SQLAlchemy, PageNotFound
+
+
+db = SQLAlchemy()
+
+
+class Item(db.Model):
+    __tablename__ = "item"
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(20))
+    rank = db.Column(db.Integer)
+
+
+def setup():
+    """ 各个测试模块共用的内存数据库，只初始化一次 """
+    if db.session is None:
+        db.use_scoped_session(sa_url="sqlite://")
+
+
+def reset(count=23):
+    db.session.remove()
+    db.drop_all()
+    db.create_all()
+    db.bulk_insert(Item, [{"id": i, "name": "n%d" % i, "rank": i % 5}
+                          for i in range(1, count + 1)])
+    db.session.commit()
+    for cache in db.cache_regions.values():
+        cache.clear()
+
+
+def test_paginate():
+    reset()
+    page = Item.query.order_by(Item.id).paginate(2, 10)
+    assert [o.id for o in page.items] == list(range(11, 21))
+    assert (page.total, page.pages, page.total_kind) == (23, 3, "exact")
+    assert page.has_prev and page.has_next
+    last = page.next()
+    assert [o.id for o in last.items] == [21, 22, 23]
+    assert not last.has_next and last.prev().page_num == 2
+
+    try:
+        Item.query.order_by(Item.id).paginate(9, 10, error_out=True)
+    except PageNotFound:
+        pass
+    else:
+        raise AssertionError("PageNotFound not raised")
+    assert Item.query.paginate(9, 10).items == []
+
+
+def test_seek_paginate():
+    reset()
+    order = (Item.rank.desc(), Item.id)
+    page = Item.query.seek_paginate(order, 5)
+    assert [(o.rank, o.id) for o in page.items] == \
+        [(4, 4), (4, 9), (4, 14), (4, 19), (3, 3)]
+    assert not page.has_prev and page.has_next
+
+    seen = [o.id for o in page.items]
+    while page.has_next:
+        page = page.next()
+        seen.extend(o.id for o in page.items)
+    assert sorted(seen) == list(range(1, 24)) and len(seen) == 23
+
+    back = page.prev()
+    assert [o.id for o in back.items] == [6, 11, 16, 21, 5]
+    try:
+        Item.query.seek_paginate(order, 5, after="not a cursor")
+    except PageNotFound:
+        pass
+    else:
+        raise AssertionError("PageNotFound not raised")
+
+
+def test_seek_paginate_nulls():
+    reset()
+    Item.query.filter(Item.id % 4 == 0).update({"rank": None},
+                                               synchronize_session=False)
+    db.session.commit()
+    rows = Item.query.with_entities(Item.id, Item.rank).all()
+    # NULL当作最大的值
+    for order, key in (
+            ((Item.rank, Item.id), lambda r: (r[1] is None, r[1], r[0])),
+            ((Item.rank.desc(), Item.id),
+             lambda r: (r[1] is not None, -(r[1] or 0), r[0]))):
+        expected = [r[0] for r in sorted(rows, key=key)]
+        page = Item.query.seek_paginate(order, 4)
+        seen = [o.id for o in page.items]
+        while page.has_next:
+            page = page.next()
+            seen.extend(o.id for o in page.items)
+        assert seen == expected, (seen, expected)
+
+        back = []
+        while page.has_prev:
+            page = page.prev()
+            back = [o.id for o in page.items] + back
+        assert back == expected[:20], (back, expected)
+
+
+def main():
+    setup()
+    test_paginate()
+    test_seek_paginate()
+    test_seek_paginate_nulls()
+    db.session.remove()
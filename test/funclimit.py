@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import multiprocessing
+from moon.funclimit import LimitTimes, LocalBackend, SQLiteBackend
+
+
+def run_threads(func, threads=8, calls=25):
+    """ 多个线程同时开始调用，返回所有的结果
+    调低线程切换的间隔，让没有加锁的计数更容易出错
+    """
+    if hasattr(sys, "setswitchinterval"):
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        restore = lambda: sys.setswitchinterval(interval)
+    else:
+        interval = sys.getcheckinterval()
+        sys.setcheckinterval(1)
+        restore = lambda: sys.setcheckinterval(interval)
+    try:
+        return _run_threads(func, threads, calls)
+    finally:
+        restore()
+
+
+def _run_threads(func, threads, calls):
+    start = threading.Event()
+    results = []
+
+    def worker():
+        start.wait()
+        for _ in range(calls):
+            results.append(func())
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for t in workers:
+        t.start()
+    start.set()
+    for t in workers:
+        t.join()
+    return results
+
+
+def test_threads():
+    for strategy in ("log", "window", "bucket"):
+        for _ in range(5):
+            @LimitTimes(50, 600, silence=True, strategy=strategy)
+            def limited():
+                return "OK"
+            results = run_threads(limited)
+            assert len(results) == 200
+            assert results.count("OK") == 50, (strategy, results.count("OK"))
+
+
+def test_keys():
+    @LimitTimes(3, 600, silence=True, key="user")
+    def peruser(user):
+        return user
+    results = run_threads(lambda: [peruser(u) for u in range(4)], calls=10)
+    for user in range(4):
+        assert sum(r.count(user) for r in results) == 3
+
+    # 超出max_keys时淘汰最久没有调用的key
+    backend = LocalBackend(max_keys=2)
+
+    @LimitTimes(1, 600, silence=True, key="user", backend=backend)
+    def evicted(user):
+        return user
+    assert [evicted(u) for u in (1, 2, 1, 3, 2)] == [1, 2, None, 3, 2]
+
+
+def _shared_calls(path):
+    backend = SQLiteBackend(path, "test")
+
+    @LimitTimes(15, 600, silence=True, strategy="window", backend=backend)
+    def shared():
+        return "OK"
+    return [shared() for _ in range(10)]
+
+
+def test_processes(tmpdir):
+    path = os.path.join(tmpdir, "funclimit.db")
+    SQLiteBackend(path, "test")
+    pool = multiprocessing.Pool(4)
+    try:
+        results = pool.map(_shared_calls, [path] * 4)
+    finally:
+        pool.close()
+        pool.join()
+    assert sum(r.count("OK") for r in results) == 15
+    # 不同name的限制互不影响
+    other = LimitTimes(1, 600, backend=SQLiteBackend(path, "other"))
+    assert other.require_call() and not other.require_call()
+
+
+def main():
+    test_threads()
+    test_keys()
+    tmpdir = tempfile.mkdtemp()
+    try:
+        test_processes(tmpdir)
+    finally:
+        shutil.rmtree(tmpdir)
@@ -8,6 +8,7 @@ from logging import getLogger
 logger = getLogger("test.funclogger")
 
 funclogger = FuncLogger(logger)
+profiler = FuncLogger(logger, sample=2, timing=True)
 
 
 class ObjectA(object):
@@ -28,5 +29,13 @@ def funcB():
     obja.funcinclass("first", "second")
 
 
+@profiler(printkey="n")
+def funcC(n):
+    return sum(range(n))
+
+
 def main():
     funcB()
+    for n in range(5):
+        funcC(n * 1000)
+    profiler.flush()
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+import sys
+import json
+import logging
+from moon.logging import JSONFormatter
+
+
+def make_record(msg, args=(), exc_info=None, **extra):
+    logger = logging.getLogger("test.json")
+    return logger.makeRecord(logger.name, logging.WARNING, __file__, 10,
+                             msg, args, exc_info, extra=extra)
+
+
+def loads(line):
+    """ 解析一行JSON，字段名重复时报错 """
+    def pairs(items):
+        keys = [k for k, v in items]
+        assert len(keys) == len(set(keys)), keys
+        return dict(items)
+    assert "\n" not in line
+    return json.loads(line, object_pairs_hook=pairs)
+
+
+def test_fields():
+    formatter = JSONFormatter(static={"app": "moon", "level": "static"})
+    data = loads(formatter.format(
+        make_record("hello %s", ("world", ), user=1, app="extra",
+                    line="extra", logger="extra", obj=object())))
+    assert data["message"] == "hello world"
+    assert data["level"] == "WARNING" and data["logger"] == "test.json"
+    assert (data["file"], data["line"]) == (__file__, 10)
+    # 内置字段优先，然后是static，extra中的同名字段被忽略
+    assert data["app"] == "moon" and data["user"] == 1
+    assert data["obj"].startswith("<object")
+    assert "args" not in data and "exc_info" not in data
+    assert len(data["time"]) == len("2000-01-01T00:00:00.000")
+
+    # 每个logger的固定字段只编码一次，不同logger互不影响
+    other = logging.makeLogRecord({"name": "other", "msg": "x"})
+    assert loads(formatter.format(other))["logger"] == "other"
+    assert loads(formatter.format(make_record("x")))["logger"] == "test.json"
+
+
+def test_exc_info():
+    formatter = JSONFormatter()
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        record = make_record("failed", exc_info=sys.exc_info())
+    data = loads(formatter.format(record))
+    assert data["exc_info"].startswith("Traceback")
+    assert "ValueError: boom" in data["exc_info"]
+    # 再次格式化时使用缓存的exc_text
+    assert loads(formatter.format(record)) == data
+
+
+def main():
+    test_fields()
+    test_exc_info()
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+import time
+import threading
+from moon.utils import memoize
+
+
+def run_threads(func, threads=10):
+    start = threading.Event()
+
+    def worker():
+        start.wait()
+        func()
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for t in workers:
+        t.start()
+    start.set()
+    for t in workers:
+        t.join()
+
+
+def test_concurrent():
+    calls = []
+
+    @memoize(maxsize=2)
+    def square(x, y=0):
+        calls.append(x)
+        time.sleep(0.05)
+        return x * x + y
+
+    # 同一个key同时只计算一次，其它线程等待结果
+    results = []
+    run_threads(lambda: results.append(square(3)))
+    assert calls == [3] and results == [9] * 10
+    assert square.stats()["hits"] == 9 and square.stats()["misses"] == 1
+
+    # 抛出异常时不缓存，等待的线程重新计算
+    failures = []
+
+    @memoize
+    def fail(x):
+        failures.append(x)
+        time.sleep(0.02)
+        raise ValueError(x)
+
+    def call_fail():
+        try:
+            fail(1)
+        except ValueError:
+            pass
+    run_threads(call_fail, threads=3)
+    assert failures == [1] * 3
+
+
+def test_lru_and_ttl():
+    calls = []
+
+    @memoize(maxsize=2)
+    def square(x, y=0):
+        calls.append(x)
+        return x * x + y
+
+    assert [square(x) for x in (3, 4, 3, 5, 4, 3)] == [9, 16, 9, 25, 16, 9]
+    # 最近访问过的3没有被5淘汰
+    assert calls == [3, 4, 5, 4, 3], calls
+    stats = square.stats()
+    assert (stats["evictions"], stats["size"]) == (3, 2)
+    assert square(3, y=1) == square(3, y=1) == 10 and calls.count(3) == 3
+    square.invalidate(3, y=1)
+    assert square(3, y=1) == 10 and calls.count(3) == 4
+    square.clear()
+    assert square.stats()["size"] == 0
+
+    @memoize(ttl=0.05, keys={"user": lambda u: u["id"]})
+    def permissions(user, scope=None):
+        calls.append("perm")
+        return user["id"]
+    assert permissions({"id": 1}) == permissions({"id": 1, "x": 2}) == 1
+    assert calls.count("perm") == 1
+    time.sleep(0.06)
+    assert permissions({"id": 1}) == 1 and calls.count("perm") == 2
+    assert permissions.stats()["expired"] == 1
+    # 位置参数和关键字参数是不同的key
+    assert permissions(user={"id": 1}) == 1 and calls.count("perm") == 3
+
+    @memoize(key=lambda a, b: a)
+    def first(a, b):
+        calls.append("first")
+        return b
+    assert first(1, 2) == first(1, 3) == 2 and calls.count("first") == 1
+
+
+def main():
+    test_concurrent()
+    test_lru_and_ttl()
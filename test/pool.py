@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+from sqlalchemy import create_engine
+from sqlalchemy.pool import QueuePool, NullPool
+from moon.sqlalchemy import PoolStats
+
+
+def use(engine, times):
+    for _ in range(times):
+        engine.connect().close()
+
+
+def test_pool_stats(url, **options):
+    engine = create_engine(url, **options)
+    stats = PoolStats(engine)
+    conn = engine.connect()
+    snapshot = stats.snapshot()
+    assert (snapshot["checked_out"], snapshot["peak_checked_out"]) == (1, 1)
+    conn.close()
+    use(engine, 2)
+    # dispose之后新的连接池仍然有统计
+    engine.dispose()
+    use(engine, 2)
+    snapshot = stats.snapshot()
+    assert snapshot["pool"] == engine.pool.__class__.__name__
+    assert snapshot["checkouts"] == 5 and snapshot["checked_out"] == 0
+    assert snapshot["wait"]["count"] == 5 and snapshot["hold"]["count"] == 5
+    assert snapshot["connects"] >= 1
+    stats.reset()
+    assert stats.snapshot()["checkouts"] == 0
+    engine.dispose()
+    return snapshot
+
+
+def main():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        snapshot = test_pool_stats("sqlite://")
+        assert snapshot["pool"] == "SingletonThreadPool"
+        url = "sqlite:///" + os.path.join(tmpdir, "pool.db")
+        snapshot = test_pool_stats(url, poolclass=QueuePool, pool_size=2)
+        assert snapshot["pool_size"] == 2 and snapshot["pool_checkedin"] == 1
+        snapshot = test_pool_stats(url, poolclass=NullPool)
+        assert snapshot["connects"] == 5 and snapshot["closes"] >= 4
+    finally:
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+from test.database import db, setup, reset
+from test.counts import count_statements
+
+
+class Author(db.Model):
+    __tablename__ = "author"
+    id = db.Column(db.Integer, primary_key=True)
+    bio = db.relationship("Bio", uselist=False)
+
+
+class Bio(db.Model):
+    __tablename__ = "bio"
+    id = db.Column(db.Integer, primary_key=True)
+    author_id = db.Column(db.Integer, db.ForeignKey("author.id"))
+
+
+class Article(db.Model):
+    __tablename__ = "article"
+    _load_presets = {
+        "list": {"author": "joined", "author.bio": "joined",
+                 "comments": "selectin"},
+        "comments": {"comments": "subquery"},
+    }
+    id = db.Column(db.Integer, primary_key=True)
+    author_id = db.Column(db.Integer, db.ForeignKey("author.id"))
+    author = db.relationship("Author")
+    comments = db.relationship("Comment")
+
+
+class Comment(db.Model):
+    __tablename__ = "comment"
+    id = db.Column(db.Integer, primary_key=True)
+    article_id = db.Column(db.Integer, db.ForeignKey("article.id"))
+
+
+def fill():
+    reset()
+    db.bulk_insert(Author, [{"id": i} for i in range(1, 11)])
+    db.bulk_insert(Bio, [{"id": i, "author_id": i} for i in range(1, 11)])
+    db.bulk_insert(Article, [{"id": i, "author_id": i % 10 + 1}
+                             for i in range(1, 31)])
+    db.bulk_insert(Comment, [{"id": i, "article_id": i % 30 + 1}
+                             for i in range(1, 91)])
+    db.session.commit()
+
+
+def touch(articles):
+    return sum(len(a.comments) + (a.author.bio is not None)
+               for a in articles)
+
+
+def test_paginate_presets():
+    fill()
+    # query绑定了创建时的session，每次remove之后重新创建
+    query = lambda: Article.query.order_by(Article.id)
+    counts = set()
+    for per_page in (2, 5, 15):
+        db.session.remove()
+        with count_statements([]) as statements:
+            touch(query().paginate(1, per_page).items)
+        with count_statements(statements):
+            page = query().seek_paginate((Article.id,), per_page)
+            touch(page.next().items)
+        counts.add(len(statements))
+    # 每页的查询次数与每页条数无关: 总数、列表、评论，seek分页两页各两次
+    assert counts == set([7]), counts
+
+    # 不使用preset时每条记录都需要懒加载
+    db.session.remove()
+    with count_statements([]) as statements:
+        touch(query().limit(5).all())
+    assert len(statements) > 10
+
+
+def test_with_preset():
+    fill()
+    with count_statements([]) as statements:
+        articles = Article.query.with_preset("comments") \
+            .order_by(Article.id).paginate(1, 5).items
+        assert sum(len(a.comments) for a in articles) == 15
+    assert len(statements) == 3
+    try:
+        Article.query.with_preset("missing")
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("ValueError not raised")
+    # 没有定义preset的Model不受影响
+    assert len(Author.query.paginate(1, 4).items) == 4
+
+
+def main():
+    setup()
+    test_paginate_presets()
+    test_with_preset()
+    db.session.remove()
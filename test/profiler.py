@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import shutil
+import logging
+import tempfile
+from test.database import db, Item, setup, reset
+
+
+# 慢查询和N+1的警告不输出
+logger = logging.getLogger("test.profiler")
+logger.disabled = True
+
+
+def test_statements():
+    reset()
+    profiler = db.enable_profiler(slow_threshold=0, n_plus_one=100,
+                                   logger=logger)
+    try:
+        for i in range(1, 4):
+            db.session.query(Item).get(i)
+        db.session.query(Item).count()
+        stats = dict((s["statement"], s) for s in profiler.statements())
+        assert sorted(s["count"] for s in stats.values()) == [1, 3]
+        for s in stats.values():
+            assert sum(s["histogram"].values()) == s["count"]
+            assert s["max"] <= s["total"]
+        # 阈值为0时每条语句都是慢查询，调用位置指向这个文件
+        assert len(profiler.slow_queries) == 4
+        assert all(__name__.replace(".", os.sep) in q["call_site"]
+                   for q in profiler.slow_queries)
+        profiler.reset()
+        assert profiler.statements() == [] and not profiler.slow_queries
+    finally:
+        db.session.remove()
+        db.disable_profiler()
+    db.session.query(Item).get(5)
+    assert not profiler.statements()
+
+
+def test_n_plus_one():
+    reset()
+    profiler = db.enable_profiler(n_plus_one=5, logger=logger)
+    try:
+        # 同一次连接借出中的重复语句，归还连接之后才记录
+        for i in range(1, 8):
+            db.session.query(Item).get(i)
+        assert not profiler.n_plus_one_queries
+        db.session.remove()
+        (record, ) = profiler.n_plus_one_queries
+        assert record["count"] == 7
+        assert "test_n_plus_one" in record["call_site"]
+
+        for i in range(1, 5):
+            db.session.query(Item).get(i)
+        db.session.remove()
+        assert len(profiler.n_plus_one_queries) == 1
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, "profile.json")
+            profiler.dump(filename)
+            with open(filename) as f:
+                report = json.load(f)
+        finally:
+            shutil.rmtree(tmpdir)
+        assert len(report["n_plus_one"]) == 1 and report["statements"]
+    finally:
+        db.disable_profiler()
+
+
+def main():
+    setup()
+    test_statements()
+    test_n_plus_one()
+    db.session.remove()
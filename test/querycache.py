@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+from sqlalchemy import event, text
+from moon.sqlalchemy import QueryCache, LRUBackend
+from test.database import db, Item, setup, reset
+
+
+db.cache_regions["tiny"] = QueryCache(LRUBackend(2))
+
+
+class Tag(db.Model):
+    __tablename__ = "tag"
+    id = db.Column(db.Integer, primary_key=True)
+
+
+def query():
+    return Item.query.filter(Item.id < 3).order_by(Item.id).cached()
+
+
+def test_query_cache():
+    reset()
+    stats = db.cache_regions["default"].stats
+    assert [o.name for o in query().all()] == ["n1", "n2"]
+    db.session.remove()
+    items = query().all()
+    assert stats()["hits"] == 1 and items[0] in db.session
+
+    # 修改过的表的缓存在提交后失效
+    Tag.query.cached().all()
+    items[0].name = "changed"
+    db.session.commit()
+    assert [o.name for o in query().all()] == ["changed", "n2"]
+    assert stats()["invalidations"] == 1
+
+    # 未提交的数据不会进入缓存，回滚之后也不会读到
+    db.session.add(Item(id=50, name="n50"))
+    db.session.flush()
+    assert Item.query.filter(Item.id == 50).cached().count() == 1
+    db.session.rollback()
+    assert Item.query.filter(Item.id == 50).cached().all() == []
+
+    # 文本语句无法判断修改的表，失效全部缓存
+    hits = stats()["hits"]
+    Tag.query.cached().all()
+    db.session.execute(text("UPDATE item SET name = 'raw' WHERE id = 1"))
+    db.session.commit()
+    assert query().first().name == "raw"
+    Tag.query.cached().all()
+    assert stats()["hits"] == hits + 1
+
+    tiny = db.cache_regions["tiny"]
+    for i in range(1, 5):
+        Item.query.filter(Item.id == i).cached(region="tiny").all()
+    assert tiny.stats()["evictions"] == 2 and len(tiny._keys) == 2
+
+
+def test_stamp():
+    cache = QueryCache()
+    stamp = cache.stamp(["item", "tag"])
+    cache.invalidate_tables(["other"])
+    cache.set("a", [1], ["item", "tag"], stamp=stamp)
+    assert cache.get("a") == [1]
+
+    for expire in (lambda: cache.invalidate_tables(["tag"]), cache.clear):
+        stamp = cache.stamp(["tag", "item"])
+        expire()
+        cache.set("b", [2], ["item", "tag"], stamp=stamp)
+        assert cache.get("b") is None
+
+
+def test_invalidated_during_query():
+    """ 查询执行的同时其他session提交并失效了缓存，结果不能写入缓存 """
+    reset()
+    cache = db.cache_regions["default"]
+    engine = db.session.get_bind()
+
+    def invalidate(conn, cursor, statement, parameters, context, many):
+        if statement.startswith("SELECT"):
+            cache.invalidate_tables(["item"])
+
+    event.listen(engine, "before_cursor_execute", invalidate)
+    try:
+        query().all()
+        db.session.query(Item.id).cached().all()
+    finally:
+        event.remove(engine, "before_cursor_execute", invalidate)
+    misses = cache.stats()["misses"]
+    query().all()
+    db.session.query(Item.id).cached().all()
+    assert cache.stats()["misses"] == misses + 2
+
+
+def main():
+    setup()
+    test_query_cache()
+    test_stamp()
+    test_invalidated_during_query()
+    db.session.remove()
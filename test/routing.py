@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import sqlalchemy
+from moon.sqlalchemy import SQLAlchemy, DeletedArchiver
+from moon.sqlalchemy.routing import WRITTEN_TABLES
+
+rdb = SQLAlchemy()
+
+
+class Note(rdb.Model):
+    __tablename__ = "note"
+    id = rdb.Column(rdb.Integer, primary_key=True)
+    source = rdb.Column(rdb.String(20))
+
+
+def source(id=1):
+    return Note.query.filter_by(id=id).one().source
+
+
+def test_replica_reads():
+    assert source() == "replica"
+    assert Note.query.using("primary").one().source == "primary"
+    assert Note.query.using("r").one().source == "replica"
+    assert rdb.session.get_bind().url.database.endswith("primary")
+    rdb.session.remove()
+
+
+def test_sticky_after_write():
+    session = rdb.session
+    note = Note(id=2, source="primary")
+    session.add(note)
+    session.flush()
+    assert session.info[WRITTEN_TABLES] == set(["note"])
+    assert source() == "primary"
+    session.commit()
+    assert WRITTEN_TABLES not in session.info
+    # 提交之后仍然使用主库，刷新对象不会读到从库的旧数据(从库中没有这一行)
+    assert note.source == "primary" and source() == "primary"
+    session.rollback()
+    assert source() == "primary"
+    rdb.session.remove()
+    assert source() == "replica"
+    rdb.session.remove()
+
+
+def test_transaction_end():
+    session = rdb.session
+    session.add(Note(id=3, source="primary"))
+    session.flush()
+    assert session.info[WRITTEN_TABLES] == set(["note"])
+    session.rollback()
+    assert WRITTEN_TABLES not in session.info
+
+    if sqlalchemy.__version__ >= "1.4":
+        rdb.session.remove()
+        session = rdb.session()
+        with session.begin():
+            session.add(Note(id=4, source="primary"))
+        assert WRITTEN_TABLES not in session.info
+    rdb.session.remove()
+
+
+def main():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        urls = dict((name, "sqlite:///" + os.path.join(tmpdir, name))
+                    for name in ("primary", "replica"))
+        # dump_deleted在sessionmaker上也注册了after_flush
+        rdb.dump_deleted = DeletedArchiver(os.path.join(tmpdir, "deleted"))
+        rdb.use_scoped_session(sa_url=urls["primary"],
+                               replicas={"r": urls["replica"]})
+        for name, engine in (("primary", rdb.router.primary),
+                             ("replica", rdb.router.replicas["r"])):
+            rdb.Model.metadata.create_all(engine)
+            with engine.begin() as conn:
+                conn.execute(Note.__table__.insert(), {"id": 1,
+                                                       "source": name})
+        test_replica_reads()
+        test_sticky_after_write()
+        test_transaction_end()
+    finally:
+        rdb.session.remove()
+        shutil.rmtree(tmpdir)
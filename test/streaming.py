@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+from test.database import db, Item, setup, reset
+
+
+def test_iter_chunks():
+    reset()
+    chunks = list(Item.query.iter_chunks(10))
+    assert [len(c) for c in chunks] == [10, 10, 3]
+    assert [o.id for c in chunks for o in c] == list(range(1, 24))
+    assert not db.session.identity_map
+
+    chunks = list(Item.query.filter(Item.rank == 1).iter_chunks(
+        2, expunge=False))
+    assert [[o.id for o in c] for c in chunks] == [[1, 6], [11, 16], [21]]
+    assert len(db.session.identity_map) == 5
+    db.session.expunge_all()
+
+    # 指定了排序或者LIMIT时保持查询本身的顺序和范围
+    query = Item.query.order_by(Item.id.desc()).limit(5)
+    ids = [[o.id for o in c] for c in query.iter_chunks(3)]
+    assert ids == [[23, 22, 21], [20, 19]]
+    ids = [[o.id for o in c] for c in
+           Item.query.order_by(Item.id).offset(20).iter_chunks(2)]
+    assert ids == [[21, 22], [23]]
+
+
+def test_iter_rows():
+    reset()
+    rows = list(Item.query.with_entities(Item.id, Item.name)
+                .filter(Item.id < 3).order_by(Item.id).iter_rows())
+    assert [tuple(r) for r in rows] == [(1, "n1"), (2, "n2")]
+    # 返回行数据，不创建ORM对象
+    rows = list(Item.query.iter_rows(size=5))
+    assert len(rows) == 23 and not db.session.identity_map
+    assert rows[0].name == "n1"
+
+
+def main():
+    setup()
+    test_iter_chunks()
+    test_iter_rows()
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+import socket
+import logging
+import threading
+from moon.logging import SysLogHandler
+
+
+def record(msg, name="test.syslog"):
+    return logging.makeLogRecord({"name": name, "msg": msg,
+                                  "levelname": "INFO", "levelno": 20})
+
+
+class GatedHandler(SysLogHandler):
+    """ 后台线程在`gate`打开之前不发送，记录发送的日志 """
+    def __init__(self, **kwargs):
+        self.gate = threading.Event()
+        self.records = []
+        super(GatedHandler, self).__init__(**kwargs)
+
+    def _send(self, records):
+        self.gate.wait()
+        self.records.extend(r.msg for r in records)
+        self.sent += len(records)
+
+
+def test_udp():
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server.bind(("127.0.0.1", 0))
+    server.settimeout(5)
+    handler = SysLogHandler(address=server.getsockname(), queue_size=100,
+                            withpid=True)
+    try:
+        for i in range(10):
+            handler.handle(record("m%d" % i))
+        handler.flush()
+        assert handler.sent == 10 and handler.dropped == 0
+        messages = [server.recv(1024) for _ in range(10)]
+    finally:
+        handler.close()
+        server.close()
+    assert messages[0].startswith(b"<14>test.syslog[")
+    assert [m.split(b": ")[-1] for m in messages] == \
+        [("m%d\0" % i).encode("ascii") for i in range(10)]
+
+
+def test_tcp_batch():
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(("127.0.0.1", 0))
+    server.listen(1)
+    server.settimeout(5)
+    handler = SysLogHandler(address=server.getsockname(), queue_size=100,
+                            socktype=socket.SOCK_STREAM, batch_size=4)
+    conn = server.accept()[0]
+    try:
+        for i in range(10):
+            handler.handle(record("m%d" % i))
+        # 关闭时发送完队列中的日志
+        handler.close()
+        assert handler.sent == 10
+        data = b""
+        while data.count(b"\0") < 10:
+            data += conn.recv(4096)
+    finally:
+        conn.close()
+        server.close()
+    assert [m.split(b": ")[-1] for m in data.split(b"\0")[:-1]] == \
+        [("m%d" % i).encode("ascii") for i in range(10)]
+
+
+def fill(overflow):
+    """ 后台线程取走第一条之后阻塞，再放入5条到大小为2的队列 """
+    handler = GatedHandler(queue_size=2, overflow=overflow)
+    handler.handle(record("first"))
+    while not handler._queue.empty():
+        pass
+    for i in range(5):
+        handler.handle(record("m%d" % i))
+    return handler
+
+
+def test_overflow():
+    for overflow, expected in (("drop_oldest", ["m3", "m4"]),
+                               ("drop_new", ["m0", "m1"])):
+        handler = fill(overflow)
+        assert handler.dropped == 3
+        handler.gate.set()
+        handler.flush()
+        assert handler.records == ["first"] + expected
+        assert handler.sent == 3
+        handler.close()
+
+    handler = GatedHandler(queue_size=2, overflow="block")
+    threading.Timer(0.1, handler.gate.set).start()
+    for i in range(6):
+        handler.handle(record("m%d" % i))
+    handler.close()
+    assert handler.records == ["m%d" % i for i in range(6)]
+    assert handler.dropped == 0
+    try:
+        SysLogHandler(queue_size=1, overflow="other")
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("ValueError not raised")
+
+
+def test_after_close():
+    """ 关闭之后的日志同步发送，不会放入没有线程处理的队列 """
+    handler = GatedHandler(queue_size=2)
+    handler.gate.set()
+    handler.close()
+    assert handler._queue is None and handler._thread is None
+    raise_exceptions = logging.raiseExceptions
+    logging.raiseExceptions = False
+    try:
+        for i in range(5):
+            handler.handle(record("m%d" % i))
+    finally:
+        logging.raiseExceptions = raise_exceptions
+    assert handler.records == [] and handler.dropped == 0
+
+
+def main():
+    test_udp()
+    test_tcp_batch()
+    test_overflow()
+    test_after_close()